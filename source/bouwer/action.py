@@ -24,6 +24,15 @@ about the other layers (build and configuration).
 """
 
 import multiprocessing
+import queue
+import concurrent.futures
+import threading
+import asyncio
+import collections
+import heapq
+import hashlib
+import shlex
+import itertools
 import subprocess
 import os
 import os.path
@@ -38,24 +47,23 @@ class Worker(multiprocessing.Process):
     Implements a consumer process for executable :class:`Action` objects.
 
     The :class:`Worker` class implements a simple consumer for
-    executing :class:`Action` objects. It takes a :obj:`dict`
-    of available `actions` and receives target names of the
-    appropriate action to execute from the `work` :class:`Queue`.
+    executing :class:`Action` objects. It receives compact records
+    of the actions to execute from the `work` :class:`Queue`, as
+    returned by :func:`Action.record`. The worker does not hold the
+    actions itself, such that it starts quickly and stays small.
     The worker sends an :class:`ActionEvent` on the `events` :class:`Queue`
     before with type `ActionEvent.EXECUTE` and after executing
     an action with type `ActionEvent.FINISH`.
     """
 
-    def __init__(self, actions, work, events):
+    def __init__(self, work, events):
         """
         Constructor
 
-        :param dict actions: Dictionary with :class:`Action` objects
-        :param :class:`Queue` work: Queue to receive target names to execute
+        :param :class:`Queue` work: Queue to receive action records to execute
         :param :class:`Queue` events: Queue to publish events to the :class:`WorkerManager`
         """
         super(Worker, self).__init__()
-        self._actions = actions
         self._work    = work
         self._events  = events
 
@@ -64,17 +72,456 @@ class Worker(multiprocessing.Process):
         Main execution loop of the Worker. Does not return.
         """
         while True:
-            # Retrieve the next Action target
-            target = self._work.get()
+            # Retrieve the next Action record
+            action = Action.restore(self._work.get())
 
             # Trigger ActionEvents and execute the action
-            self._events.put(ActionEvent(self.name, target, ActionEvent.EXECUTE))
-            result = self._actions[target]()
-            self._events.put(ActionEvent(self.name, target, ActionEvent.FINISH, result))
+            self._events.put(ActionEvent(self.name, action.target, ActionEvent.EXECUTE))
+            result = action()
+            self._events.put(ActionEvent(self.name, action.target, ActionEvent.FINISH,
+                                         result, action.peak_rss))
+
+class WorkerPool(bouwer.util.Singleton):
+    """
+    Pool of long-lived :class:`Worker` processes
+
+    The pool is shared by each :class:`WorkerManager`, such that the
+    worker processes are only created once for all rounds, trees and
+    targets. Workers are started on first use and run until :func:`shutdown`.
+    Shell commands go to the workers, while python functions run on a pool
+    of threads in the main process.
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.work    = multiprocessing.Queue()
+        self.events  = multiprocessing.Queue()
+        self.workers = []
+        self.threads = None
+        self.futures = set()
+
+    def start(self, count):
+        """
+        Make sure at least `count` workers are running
+        """
+        while len(self.workers) < count:
+            worker = Worker(self.work, self.events)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, action, slots):
+        """
+        Send the record of `action` to the workers
+
+        Up to `slots` workers are started once there is work to do. Python
+        functions run on a thread pool in the main process instead, such
+        that they may update the configuration directly.
+        """
+        if callable(action.command):
+            if self.threads is None:
+                self.threads = concurrent.futures.ThreadPoolExecutor(slots)
+            self.futures.add(self.threads.submit(self._call, action))
+        else:
+            self.start(slots)
+            self.work.put(action.record())
+
+    def _call(self, action):
+        """
+        Execute the python function of `action` on a thread
+        """
+        name = threading.current_thread().name
+        self.events.put(ActionEvent(name, action.target, ActionEvent.EXECUTE))
+        result = action()
+        self.events.put(ActionEvent(name, action.target, ActionEvent.FINISH, result))
+
+    def wait(self, timeout = 1.0):
+        """
+        Wait for the next :class:`ActionEvent` from the workers
+
+        Raises an exception if a worker has exited or a python
+        function failed, since its action would otherwise never finish.
+        """
+        while True:
+            try:
+                return self.events.get(timeout=timeout)
+            except queue.Empty:
+                # Report errors of python functions
+                for future in [ f for f in self.futures if f.done() ]:
+                    self.futures.remove(future)
+                    future.result()
+
+                for proc in self.workers:
+                    if not proc.is_alive():
+                        self.workers.remove(proc)
+                        raise Exception('worker ' + proc.name + ' exited with code ' +
+                                         str(proc.exitcode))
+
+    def shutdown(self):
+        """
+        Stop all workers
+        """
+        for proc in self.workers:
+            proc.terminate()
+            proc.join()
+        self.workers = []
+
+        if self.threads is not None:
+            self.threads.shutdown(wait=False, cancel_futures=True)
+        self.threads = None
+        self.futures = set()
+
+class AsyncExecutor(bouwer.util.Singleton):
+    """
+    Runs :class:`Action` objects on an asyncio event loop
+
+    Instead of :class:`Worker` processes, a single event loop in the main
+    process starts the commands with :func:`asyncio.create_subprocess_exec`,
+    bounded by a semaphore of `--workers`. Python functions run on a thread
+    pool in the main process, where they may update the configuration. Events are delivered
+    directly, without a :class:`Queue`. The peak resident memory of commands
+    is not known in this mode.
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.loop      = None
+        self.semaphore = None
+        self.threads   = None
+        self.tasks     = set()
+        self.events    = collections.deque()
+
+    def submit(self, action, slots):
+        """
+        Start executing `action` with at most `slots` actions at once
+        """
+        if self.loop is None:
+            self.loop = asyncio.new_event_loop()
+
+        if not self.tasks:
+            self.semaphore = asyncio.Semaphore(slots)
+
+        if self.threads is None:
+            self.threads = concurrent.futures.ThreadPoolExecutor(slots)
+
+        self.tasks.add(self.loop.create_task(self._execute(action)))
+
+    async def _execute(self, action):
+        """
+        Execute `action` and publish its events
+        """
+        async with self.semaphore:
+            self.events.append(ActionEvent('async', action.target, ActionEvent.EXECUTE))
+
+            if callable(action.command):
+                result = await self.loop.run_in_executor(self.threads, action)
+            else:
+                output = subprocess.DEVNULL if action.tags.get('quiet', False) else None
+                if isinstance(action.command, list):
+                    argv = action.command
+                else:
+                    argv = [ '/bin/sh', '-c', action.command ]
+
+                try:
+                    proc = await asyncio.create_subprocess_exec(*argv, stdout=output, stderr=output,
+                                                                close_fds=False)
+                    result = await proc.wait()
+                except OSError as exc:
+                    result = action.not_found(exc, output)
+
+            self.events.append(ActionEvent('async', action.target, ActionEvent.FINISH, result))
+
+    def wait(self):
+        """
+        Run the event loop until the next :class:`ActionEvent` is available
+        """
+        while not self.events:
+            done, self.tasks = self.loop.run_until_complete(
+                asyncio.wait(self.tasks, return_when=asyncio.FIRST_COMPLETED))
+
+            # Report errors of python functions
+            for task in done:
+                task.result()
+
+        return self.events.popleft()
+
+    def shutdown(self):
+        """
+        Stop all running actions and close the event loop
+        """
+        if self.loop is not None:
+            for task in self.tasks:
+                task.cancel()
+            if self.tasks:
+                self.loop.run_until_complete(asyncio.wait(self.tasks))
+            self.loop.close()
+
+        if self.threads is not None:
+            self.threads.shutdown(wait=False, cancel_futures=True)
+
+        self.loop    = None
+        self.threads = None
+        self.tasks   = set()
+        self.events.clear()
+
+class JobServer(bouwer.util.Singleton):
+    """
+    Shares job slots with other tools using the GNU make jobserver
+
+    If `MAKEFLAGS` advertises a jobserver, for example when running from a
+    recursive make, a token is taken from the jobserver for each action
+    running next to the first. Otherwise a jobserver with `--workers` slots
+    is created and advertised in `MAKEFLAGS` to the commands executed, such
+    that nested builds, like a make started by a command, share the slots.
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.log       = logging.getLogger(__name__)
+        self.makeflags = os.environ.get('MAKEFLAGS')
+        self.reader    = None
+        self.writer    = None
+        self.opened    = []
+        self.tokens    = []
+        args = CommandLine.Instance().args
+
+        if getattr(args, 'no_jobserver', False):
+            return
+
+        auth = None
+        for word in (self.makeflags or '').split():
+            for option in [ '--jobserver-auth=', '--jobserver-fds=' ]:
+                if word.startswith(option):
+                    auth = word[len(option):]
+
+        try:
+            if auth is not None:
+                self._connect(auth)
+            elif args.workers > 1:
+                self._create(args.workers)
+        except (OSError, ValueError) as e:
+            self.log.warning('jobserver not available: ' + str(e))
+            self.shutdown()
+
+    def _open(self, fd):
+        """
+        Open the read side of the jobserver without blocking
+
+        The file descriptor is opened again, since its status
+        flags are shared with all processes using it.
+        """
+        fd = os.open('/proc/self/fd/' + str(fd), os.O_RDONLY | os.O_NONBLOCK)
+        self.opened.append(fd)
+        return fd
+
+    def _connect(self, auth):
+        """
+        Use the jobserver of the parent process
+        """
+        if auth.startswith('fifo:'):
+            self.reader = self.writer = os.open(auth[5:], os.O_RDWR | os.O_NONBLOCK)
+            self.opened.append(self.reader)
+        else:
+            reader, writer = [ int(fd) for fd in auth.split(',') ]
+            os.fstat(writer)
+            self.reader = self._open(reader)
+            self.writer = writer
+
+        self.log.debug('using jobserver: ' + auth)
+
+    def _create(self, slots):
+        """
+        Create a jobserver with `slots` slots for the commands executed
+        """
+        reader, writer = os.pipe()
+        self.opened += [ reader, writer ]
+        os.set_inheritable(reader, True)
+        os.set_inheritable(writer, True)
+        os.write(writer, b'+' * (slots - 1))
+
+        self.reader = self._open(reader)
+        self.writer = writer
+
+        flags = '-j' + str(slots) + ' --jobserver-auth=' + str(reader) + ',' + str(writer)
+        os.environ['MAKEFLAGS'] = (self.makeflags + ' ' if self.makeflags else '') + flags
+
+    def acquire(self, running):
+        """
+        Take a slot for an action next to `running` actions
+
+        The first action uses the slot given to this process. Returns
+        False if no slot is available until a running action finishes.
+        """
+        if self.reader is None or len(self.tokens) >= running:
+            return True
+
+        try:
+            token = os.read(self.reader, 1)
+        except BlockingIOError:
+            return False
+
+        if not token:
+            return False
+
+        self.tokens.append(token)
+        return True
+
+    def release(self, running):
+        """
+        Give back the slots not needed for `running` actions
+        """
+        while len(self.tokens) > max(running - 1, 0):
+            os.write(self.writer, self.tokens.pop())
+
+    def shutdown(self):
+        """
+        Give back all slots and close the jobserver
+        """
+        if self.writer is not None:
+            self.release(0)
+
+        for fd in self.opened:
+            os.close(fd)
+
+        if self.makeflags is None:
+            os.environ.pop('MAKEFLAGS', None)
+        else:
+            os.environ['MAKEFLAGS'] = self.makeflags
+
+        self.reader = None
+        self.writer = None
+        self.opened = []
+        self.tokens = []
+
+class Throttle(bouwer.util.Singleton):
+    """
+    Holds back new actions while the system is overloaded
+
+    Like `make -l`, no new action starts while the load average is
+    above `--max-load`, or while less than `--min-free-memory` megabytes
+    of memory are available. One action may always run, such that the
+    build makes progress. The number of times actions were held back
+    is reported after the build.
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        args = CommandLine.Instance().args
+        self.log      = logging.getLogger(__name__)
+        self.max_load = getattr(args, 'max_load', 0)
+        self.min_free = getattr(args, 'min_free_memory', 0)
+        self.count    = 0
+
+    def overloaded(self):
+        """
+        See if new actions must wait, and count it if so
+        """
+        free = self.available() if self.min_free > 0 else None
+
+        if self.max_load > 0 and os.getloadavg()[0] > self.max_load:
+            reason = 'load average above ' + str(self.max_load)
+        elif free is not None and free < self.min_free * 1024:
+            reason = 'free memory below ' + str(self.min_free) + 'M'
+        else:
+            return False
+
+        self.count += 1
+        self.log.debug('throttled: ' + reason)
+        return True
+
+    def available(self):
+        """
+        Return the available memory in kilobytes, or `None` if unknown
+        """
+        try:
+            with open('/proc/meminfo') as fp:
+                for line in fp:
+                    if line.startswith('MemAvailable:'):
+                        return int(line.split()[1])
+        except (IOError, ValueError):
+            pass
+        return None
+
+    def report(self):
+        """
+        Output how often new actions were held back
+        """
+        if self.count:
+            print('Throttled ' + str(self.count) + ' times due to system load')
+
+""" Executors which can be selected with `--executor` """
+EXECUTORS = { 'process' : WorkerPool, 'async' : AsyncExecutor }
+
+class ActionHistory(object):
+    """
+    Persistent record of executed :class:`Action` objects
+
+    For each target and hash of the command which produced it, the
+    wall time in seconds, exit code and peak resident memory in kilobytes
+    of its last execution are kept.
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.cache = bouwer.util.Cache.Instance('history')
+
+    def _key(self, action):
+        """
+        Return the key of an `action` in the history
+        """
+        return action.target + ':' + action.command_hash()
+
+    def record(self, action, duration, result, peak_rss):
+        """
+        Save the execution results of an `action`
+
+        :param :class:`Action` action: the action which finished
+        :param float duration: wall time in seconds
+        :param int result: exit code of the action
+        :param int peak_rss: peak resident memory in kilobytes, if known
+        """
+        self.cache.put(self._key(action), (duration, result, peak_rss))
+
+    def estimate(self, action):
+        """
+        Retrieve the expected duration of an `action` in seconds
+
+        Returns `None` if the `action` did not execute before
+        with the same command.
+        """
+        entry = self.cache.get(self._key(action))
+
+        if entry is not None:
+            return entry[0]
 
 class WorkerManager:
     """
-    Manages a pool of :class:`Worker` processes
+    Schedules :class:`Action` objects on an executor
+
+    Actions run on the :class:`WorkerPool` or, with `--executor=async`,
+    on the :class:`AsyncExecutor`.
+
+    The :class:`WorkerManager` schedules :class:`Action` objects using
+    a reverse dependency index. Each :class:`Action` keeps a counter of
+    dependencies which have not yet finished. When an :class:`Action`
+    finishes, only the actions which depend on its target are updated
+    and, once their counter drops to zero, moved to the ready queue.
+
+    With the `critical-path` schedule, the ready queue is ordered by the
+    longest remaining path through the dependency graph, such that long
+    chains of actions, like the final link steps, start as early as possible.
+    The path is weighted by durations from the :class:`ActionHistory` when
+    available, or by the number of actions otherwise.
     """
 
     def __init__(self, actions):
@@ -84,27 +531,64 @@ class WorkerManager:
         :param dict actions: Dictionary with :class:`Action` objects
         """
         self.actions  = actions
-        self.work     = multiprocessing.Queue()
-        self.events   = multiprocessing.Queue()
-        self.workers  = []
+        self.executor = EXECUTORS[CommandLine.Instance().args.executor].Instance()
+        self.jobs     = JobServer.Instance()
+        self.throttle = Throttle.Instance()
         self.log      = logging.getLogger(__name__)
         self.output_plugin = getattr(CommandLine.Instance().args, 'output_plugin', None)
         self.running  = []
         self.pending  = self.actions.copy()
+        self.ready    = []
+        self.waiting  = {}
+        self.priority = {}
+        self.sequence = itertools.count()
+        self.dependents = {}
+        self.slots    = CommandLine.Instance().args.workers
+        self.history  = ActionHistory()
+        self.signatures = bouwer.util.Cache.Instance('signatures')
+        self.rebuild_check = CommandLine.Instance().args.rebuild_check
+        self.digests  = bouwer.util.DigestIndex.Instance()
+        self.stats    = bouwer.util.StatCache.Instance()
+        self.source_digests = bouwer.util.Cache.Instance('source_digests')
+        self.building = {}
+        self.held     = None
+        self.failed   = []
+        self.started  = {}
+        self.estimates = {}
 
-        # Create workers
-        for i in range(CommandLine.Instance().args.workers):
-            worker = Worker(self.actions, self.work, self.events)
-            self.workers.append(worker)
-            worker.start()
+        # Retrieve expected durations. Unknown actions take the average.
+        for action in self.actions.values():
+            self.estimates[action.target] = self.history.estimate(action)
 
-    def __del__(self):
-        """
-        Destructor
-        """
-        for proc in self.workers:
-            proc.terminate()
-            proc.join()
+        known = [ e for e in self.estimates.values() if e is not None ]
+        self.timed = len(known) > 0
+        self.default_weight = sum(known) / len(known) if known else 1
+
+        for target, estimate in self.estimates.items():
+            if estimate is None:
+                self.estimates[target] = self.default_weight
+
+        self.total = float(sum(self.estimates.values()))
+        self.todo  = self.total
+
+        # Build the reverse dependency index
+        for action in self.actions.values():
+            depends = set([src for src in action.sources
+                           if src in self.actions and src != action.target])
+
+            for src in depends:
+                self.dependents.setdefault(src, []).append(action)
+
+            self.waiting[action.target] = len(depends)
+
+        # Determine the priority of each action
+        if CommandLine.Instance().args.schedule == 'critical-path':
+            self._prioritize()
+
+        # Actions without dependencies are ready to go
+        for action in self.actions.values():
+            if self.waiting[action.target] == 0:
+                self._push(action)
 
     def execute(self):
         """
@@ -113,32 +597,64 @@ class WorkerManager:
         self.log.debug("running actions")
 
         while True:
-            collecting = True
 
             # Make as much as possible work available
-            while collecting or (self.pending and not self.running):
-                collecting = False
-
-                for key in list(self.pending.keys()):
-                    action = self.pending[key]
-                    if self.decide(action):
-                        action.status = ActionEvent.EXECUTE
-                        self.work.put(action.target)
-                        self.running.append(action)
-                        del self.pending[key]
-                        collecting = True
+            while (self.ready or self.held) and len(self.running) < self.slots:
+                if self.held is None:
+                    action = heapq.heappop(self.ready)[2]
+                    del self.pending[action.target]
+                    self.todo -= self.estimates[action.target]
+
+                    if not self.decide(action):
+                        # None of the sources is updated and we exist. Don't build.
+                        action.status = ActionEvent.FINISH
+                        self._release(action)
+                        continue
+
+                    if self.rebuild_check != 'mtime':
+                        self.building[action.target] = self._digest_sources(action)
+                    self.held = action
+
+                # Always allow one action, such that the build progresses
+                if self.running and self.throttle.overloaded():
+                    break
+
+                # Actions next to the first need a slot of the jobserver
+                if not self.jobs.acquire(len(self.running)):
+                    break
+
+                action, self.held = self.held, None
+                action.status = ActionEvent.EXECUTE
+                self.running.append(action)
+                self.executor.submit(action, self.slots)
 
             # Wait for events
             if not self.running:
                 break
 
-            event  = self.events.get()
+            event  = self.executor.wait()
             action = self.actions[event.target]
             action.status = event.type
             self.log.debug("event: " + str(event))
 
-            if action.status == ActionEvent.FINISH:
+            if action.status == ActionEvent.EXECUTE:
+                self.started[action.target] = event.time
+
+            elif action.status == ActionEvent.FINISH:
                 self.running.remove(action)
+                self.jobs.release(len(self.running))
+                duration = event.time - self.started.pop(action.target, event.time)
+                self.history.record(action, duration.total_seconds(),
+                                    event.result, event.peak_rss)
+
+                if event.result == 0:
+                    self.signatures.put(action.target, action.signature())
+
+                    if action.target in self.building:
+                        self.source_digests.put(action.target,
+                                                self.building.pop(action.target))
+                else:
+                    self.failed.append(action.target)
 
             # Report the event to the builder
             action.builder.action_event(action, event)
@@ -147,51 +663,207 @@ class WorkerManager:
             if self.output_plugin:
                 self.output_plugin.action_event(action, event)
 
+            # The target is written now. Dependent actions may be ready.
+            if action.status == ActionEvent.FINISH:
+                self.stats.invalidate(action.target)
+                self._release(action)
+
+        # Actions left behind can never become ready.
+        if self.pending:
+            raise Exception("circular dependency between targets: " +
+                             str(sorted(self.pending.keys())))
+
+    def _release(self, action):
+        """
+        Update the actions which depend on the finished `action`
+
+        :param :class:`Action` action: the action which finished
+        """
+        for dependent in self.dependents.get(action.target, []):
+            self.waiting[dependent.target] -= 1
+
+            if self.waiting[dependent.target] == 0:
+                self._push(dependent)
+
+    def _push(self, action):
+        """
+        Add an `action` to the ready queue
+
+        Actions with the highest priority are dispatched first. Actions
+        of equal priority are dispatched in the order they became ready.
+
+        :param :class:`Action` action: the action to add
+        """
+        heapq.heappush(self.ready, (-self.priority.get(action.target, 0),
+                                    next(self.sequence), action))
+
+    def _prioritize(self):
+        """
+        Compute the longest remaining path of each :class:`Action`
+
+        The priority of an :class:`Action` is its own weight plus the
+        highest priority of the actions depending on it.
+        """
+        waiting = self.waiting.copy()
+        todo    = [ a for a in self.actions.values() if waiting[a.target] == 0 ]
+        order   = []
+
+        # Sort the actions topologically
+        while todo:
+            action = todo.pop()
+            order.append(action)
+
+            for dependent in self.dependents.get(action.target, []):
+                waiting[dependent.target] -= 1
+                if waiting[dependent.target] == 0:
+                    todo.append(dependent)
+
+        # Walk back from the end of the graph
+        for action in reversed(order):
+            remaining = [ self.priority[d.target]
+                          for d in self.dependents.get(action.target, []) ]
+            self.priority[action.target] = self.weight(action) + max(remaining or [0])
+
+    def weight(self, action):
+        """
+        Estimate the cost of executing an `action`
+
+        :param :class:`Action` action: the action to estimate
+        """
+        return self.estimates[action.target]
+
+    def progress(self):
+        """
+        Estimate the progress of executing all actions
+
+        Returns a tuple with the fraction of work done and
+        the estimated number of seconds left. The number of seconds
+        is `None` if none of the actions executed before.
+        """
+        now       = datetime.datetime.now()
+        remaining = 0.0 if not self.pending else max(self.todo, 0.0)
+        critical  = 0.0
+
+        # The longest path left starts either at a running or ready action.
+        if self.ready:
+            critical = -self.ready[0][0]
+
+        for action in self.running:
+            elapsed = 0.0
+            if action.target in self.started:
+                elapsed = (now - self.started[action.target]).total_seconds()
+
+            left = max(self.estimates[action.target] - elapsed, 0.0)
+            remaining += left
+            critical = max(critical, self.priority.get(action.target, 0) -
+                                     self.estimates[action.target] + left)
+
+        done = 1.0 - remaining / self.total if self.total else 1.0
+
+        if not self.timed:
+            return (done, None)
+
+        return (done, max(remaining / self.slots, critical))
+
     def decide(self, action):
         """
         Decide if this action needs to run.
 
+        The dependencies of the `action` must have finished already.
+        An action runs if its target is missing, older than one of its
+        sources or produced by a different command. With the `hash` rebuild
+        check, the content of the sources is compared to the last build
+        instead of their timestamp. The `mtime+hash` check only compares
+        the content of sources which are newer than the target.
+
         :param :class:`Action` action: the action to try
 
         Returns `True` if the :class:`Action` needs to run or `False` otherwise.
         """
-        need_run = False
-
         # Is/has the action already ran?
         if action.status is not ActionEvent.CREATE:
             return False
 
+        # Allow override to enfore full build from command line
+        if CommandLine.Instance().args.force:
+            return True
+
         # Try to see if the target exists
-        try:
-            my_st = os.stat(action.target)
-        except OSError:
-            need_run = True
+        my_st = self.stats.stat(action.target)
+        if my_st is None:
+            return True
 
-        # Do all our dependencies satisfy?
-        for src in action.sources:
-            try:
-                if self.actions[src].status != ActionEvent.FINISH:
-                    return False
-            except KeyError:
-                pass
+        # Retrieve the content of the sources at the last build, if needed.
+        recorded = None
+        if self.rebuild_check != 'mtime':
+            recorded = self.source_digests.get(action.target)
 
-            # See if their timestamp is larger than ours
-            try:
-                st = os.stat(src)
-                if not need_run and st.st_mtime > my_st.st_mtime:
-                    need_run = True
-            except OSError:
-                pass
+        # See if the timestamp or content of our sources changed
+        if recorded is None:
+            need_run = any(self._newer(src, my_st) for src in action.sources)
 
-        # Allow override to enfore full build from command line
-        if CommandLine.Instance().args.force or need_run:
-            return True
+            if not need_run and self.rebuild_check != 'mtime':
+                self.source_digests.put(action.target, self._digest_sources(action))
+
+        else:
+            if self.rebuild_check == 'hash':
+                need_run = self._changed(action.sources, recorded, my_st)
+            else:
+                need_run = self._changed([ src for src in action.sources
+                                           if self._newer(src, my_st) ], recorded, my_st)
+
+            # Remember the content of newly discovered sources
+            if not need_run and set(recorded) != set(action.sources):
+                self.source_digests.put(action.target, self._digest_sources(action))
+
+        # See if the command changed since the target was built.
+        # Existing targets without a signature are adopted as they are.
+        if not need_run:
+            signature = action.signature()
+            previous  = self.signatures.get(action.target)
+
+            if previous is None:
+                self.signatures.put(action.target, signature)
+            elif previous != signature:
+                need_run = True
 
-        # None of the sources is updated and we exist. Don't build.
-        action.status = ActionEvent.FINISH
-        del self.pending[action.target]
+        return need_run
+
+    def _newer(self, src, target_st):
+        """
+        See if the file `src` is modified after the target
+
+        :param str src: path to the source file
+        :param target_st: result of :func:`os.stat` on the target
+        """
+        st = self.stats.stat(src)
+        return st is not None and st.st_mtime > target_st.st_mtime
+
+    def _changed(self, sources, recorded, target_st):
+        """
+        See if the content of any of the `sources` changed
+
+        Sources which were not known at the last build, like
+        newly discovered headers, fall back to their timestamp.
+
+        :param list sources: paths to the source files
+        :param dict recorded: digests of the sources at the last build
+        :param target_st: result of :func:`os.stat` on the target
+        """
+        for src in sources:
+            if src not in recorded:
+                if self._newer(src, target_st):
+                    return True
+            elif self.digests.digest(src) != recorded[src]:
+                return True
         return False
 
+    def _digest_sources(self, action):
+        """
+        Retrieve the current content digests of the sources of an `action`
+        """
+        return dict([ (src, self.digests.digest(src)) for src in action.sources ])
+
 class ActionEvent:
     """
     Represents an event which occurred for an :class:`.Action`
@@ -201,7 +873,7 @@ class ActionEvent:
     EXECUTE = 'execute'
     FINISH  = 'finish'
 
-    def __init__(self, worker, target, event_type, result = None):
+    def __init__(self, worker, target, event_type, result = None, peak_rss = None):
         """
         Constructor
 
@@ -209,11 +881,13 @@ class ActionEvent:
         :param str target: target of the :class:`Action` for this event
         :param str event_type: type of event
         :param int result: exit code of the :class:`Action`
+        :param int peak_rss: peak resident memory in kilobytes of the :class:`Action`
         """
         self.worker = worker
         self.target = target
         self.type   = event_type
         self.result = result
+        self.peak_rss = peak_rss
         self.time   = datetime.datetime.now()
 
     def __str__(self):
@@ -241,7 +915,8 @@ class Action:
 
         :param str target: target file for the action
         :param list sources: a `list` of source files as dependency
-        :param str command: Either a `str` with a shell command or a python function
+        :param str command: Either a `str` with a shell command, a `list` of
+                            arguments to execute directly or a python function
         :param dict tags: Dictionary with parameters called tags
         :param :class:`Plugin` builder: the builder that generated this action
         """
@@ -251,10 +926,14 @@ class Action:
         self.tags    = tags
         self.builder = builder
         self.status  = ActionEvent.CREATE
+        self.peak_rss = None
 
     def __call__(self):
         """
         Execute the action
+
+        Returns the exit code of the command. For shell commands,
+        the peak resident memory in kilobytes is saved in `peak_rss`.
         """
 
         # If the command is a python function, run it.
@@ -262,21 +941,100 @@ class Action:
             return self.command(self)
 
         # If quiet mode is set, do not show any output
-        if 'quiet' in self.tags and self.tags['quiet']: 
-            try:
-                subprocess.check_output(self.command, stderr=subprocess.PIPE, shell=True)
-                return 0
-            except subprocess.CalledProcessError as e:
-                return e.returncode
+        if 'quiet' in self.tags and self.tags['quiet']:
+            output = subprocess.DEVNULL
         else:
-            return os.system(self.command)
+            output = None
+
+        # Lists of arguments are executed directly, without a shell. Only
+        # inheritable descriptors, like those of the jobserver, stay open.
+        try:
+            proc = subprocess.Popen(self.command, stdout=output, stderr=output,
+                                    shell=isinstance(self.command, str), close_fds=False)
+        except OSError as exc:
+            return self.not_found(exc, output)
+
+        pid, status, usage = os.wait4(proc.pid, 0)
+        self.peak_rss = usage.ru_maxrss
+
+        if os.WIFSIGNALED(status):
+            proc.returncode = -os.WTERMSIG(status)
+        else:
+            proc.returncode = os.WEXITSTATUS(status)
+        return proc.returncode
+
+    def not_found(self, exc, output):
+        """
+        Report a program which could not be started
+
+        Returns 127, the exit code of a shell for unknown commands.
+        """
+        if output is None:
+            sys.stderr.write(str(exc) + '\n')
+        return 127
+
+    def record(self):
+        """
+        Return a compact record to execute the action in a :class:`Worker`
+
+        The record holds the target, the shell command and the tags needed
+        for execution. Returns None if the command is a python function,
+        which runs in the main process instead.
+        """
+        if callable(self.command):
+            return None
+
+        return (self.target, self.command, { 'quiet' : self.tags.get('quiet', False) })
+
+    @staticmethod
+    def restore(record):
+        """
+        Create an :class:`Action` from a record made by :func:`record`
+        """
+        target, command, tags = record
+        return Action(target, [], command, tags, None)
+
+    def command_line(self):
+        """
+        Return the command as it would be typed in a shell
+        """
+        if isinstance(self.command, list):
+            return shlex.join(self.command)
+        return str(self.command)
+
+    def command_hash(self):
+        """
+        Compute a hash of the command
+
+        Python functions are identified by their module and name.
+        """
+        if callable(self.command):
+            text = self.command.__module__ + '.' + \
+                   getattr(self.command, '__qualname__', self.command.__name__)
+        else:
+            text = self.command_line()
+
+        return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+    def signature(self):
+        """
+        Compute a hash of the command and the sorted list of sources
+
+        The target must be rebuilt when its signature changes. Implicit
+        sources, like discovered C headers, are listed in the `implicit`
+        tag. These are left out, as they may change by discovery alone.
+        """
+        implicit = set(self.tags.get('implicit', []))
+        sources  = [ src for src in self.sources if src not in implicit ]
+        text = self.command_hash() + '\n' + '\n'.join(sorted(sources))
+        return hashlib.md5(text.encode('utf-8')).hexdigest()
 
     def __str__(self):
         """
         Convert to string representation
         """
         return self.target   + " <<< sources=" + \
-           str(self.sources) + " status=" + self.status + " : [" + str(self.command) + "]"
+           str(self.sources) + " status=" + self.status + " : [" + self.command_line() + "]"
 
     def __repr__(self):
         """
@@ -295,6 +1053,7 @@ class ActionManager(object):
         """
         self.log     = logging.getLogger(__name__)
         self.actions = {}
+        self.failed  = []
 
     def submit(self, target, sources, command, tags, builder):
         """
@@ -302,7 +1061,8 @@ class ActionManager(object):
 
         :param str target: target file for the action
         :param list sources: a `list` of source files as dependency
-        :param str command: Either a `str` with a shell command or a python function
+        :param str command: Either a `str` with a shell command, a `list` of
+                            arguments to execute directly or a python function
         :param dict tags: Dictionary with parameters called tags
         :param :class:`Plugin` builder: the builder that generated this action
         """
@@ -326,9 +1086,40 @@ class ActionManager(object):
                     os.remove(action.target)
                 except OSError:
                     pass
+                bouwer.util.StatCache.Instance().invalidate(action.target)
+
+                # Also remove generated dependency files
+                if 'depfile' in action.tags:
+                    try:
+                        os.remove(action.tags['depfile'])
+                    except OSError:
+                        pass
         else:
+            args    = CommandLine.Instance().args
+            actions = self.actions
+
+            # Run a single action, on behalf of another build tool
+            if getattr(args, 'run_action', None):
+                if args.run_action in actions:
+                    self.log.debug("running: " + args.run_action)
+                    sys.exit(actions[args.run_action]())
+
+                actions = self._config_actions()
+
+            # Export plugins may take over the actions
+            elif getattr(args, 'export_plugin', None) is not None:
+                actions = args.export_plugin.export_actions(actions)
+
             # Allow output plugins
-            self.workers = WorkerManager(self.actions)
+            self.workers = WorkerManager(actions)
             self.workers.execute()
+            self.failed += self.workers.failed
             self.workers = None
             self.actions.clear()
+
+    def _config_actions(self):
+        """
+        Return the actions of builders which produce configuration
+        """
+        return dict([ (target, action) for target, action in self.actions.items()
+                                        if action.builder.config_action_output() ])
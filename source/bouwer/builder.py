@@ -25,6 +25,8 @@ import sys
 import copy
 import logging
 import glob
+import hashlib
+import inspect
 import shutil
 import bouwer.config
 import bouwer.action
@@ -126,7 +128,7 @@ class BuilderInstance:
             relative = self.manager.conf.active_dir
             path = relative + os.sep + src
 
-            src_list = glob.glob(path)
+            src_list = self.manager.graph.glob(path)
             if not src_list:
                 src_list.append(path)
 
@@ -290,10 +292,16 @@ class BuilderMesh:
                     if self._try_execute(instance):
                         again = True
 
+            # Builders may still be registering actions
+            self.manager.run_deferred()
+
             if self.manager.conf.args.clean:
                 self.manager.actions.run(True)
                 shutil.rmtree(bouwer.util.BOUWTEMP, True)
+                bouwer.util.StatCache.Instance().clear()
+                bouwer.util.Cache.ClearAll()
             else:
+                self.manager.rounds.append(list(self.manager.actions.actions.values()))
                 self.manager.actions.run()
 
 class BuilderParser:
@@ -308,6 +316,7 @@ class BuilderParser:
         self.manager   = manager
         self.mesh = BuilderMesh(manager)
         self.builders = {}
+        self.bouwfiles = {}
         self.log = logging.getLogger(__name__)
  
         # Detects all plugins with an execute() builder function
@@ -323,27 +332,30 @@ class BuilderParser:
 
     def parse(self, dirname, target):
         """ 
-        Scan a directory for Bouwfiles
-        """
-        found = False
+        Invoke the `target` function of each Bouwfile
 
-        # Look for all Bouwfiles.
-        for filename in os.listdir(dirname):
-            if filename.endswith('Bouwfile'):
-                self._parse_bouwfile(dirname + os.sep + filename, target)
-                found = True
+        The Bouwfiles are found and executed only once, after which the
+        target functions each of them defines are remembered.
+        """
+        if dirname not in self.bouwfiles:
+            walker = bouwer.util.ProjectWalker.Instance()
+            self.bouwfiles[dirname] = [ self._parse_bouwfile(filename)
+                                        for filename in walker.walk(dirname, 'Bouwfile') ]
 
-        # Only scan subdirectories if at least one Bouwfile found.
-        if found:
-            for filename in os.listdir(dirname):
-                if os.path.isdir(dirname + os.sep + filename):
-                    self.parse(dirname + os.sep + filename, target)
+        # Execute the target routine, if defined in the Bouwfile.
+        for filename, targets in self.bouwfiles[dirname]:
+            if target in targets:
+                self.manager.conf.active_dir = os.path.dirname(filename)
+                targets[target](self.manager.conf.active_tree)
 
         return self.mesh
 
-    def _parse_bouwfile(self, filename, target):
+    def _parse_bouwfile(self, filename):
         """ 
         Parse a Bouwfile
+
+        Returns the filename and a dictionary with the target functions
+        defined by the Bouwfile.
         """
         self.log.debug("parsing `" + filename + "'")
     
@@ -363,11 +375,203 @@ class BuilderParser:
         globs = copy.copy(self.builders)
 
         # Parse the given file
-        exec(compile(open(filename).read(), filename, 'exec'), globs)
+        exec(bouwer.util.CodeCache.Instance().compile(filename), globs)
+
+        targets = {}
+        for name, value in globs.items():
+            if inspect.isfunction(value) and name not in self.builders:
+                targets[name] = value
+
+        return filename, targets
+
+class ActionGraph:
+    """
+    Persistent record of the actions generated for a target
+
+    After a successful run, the rounds of actions generated by the
+    builders are saved with a fingerprint of their inputs: the Bouwfiles,
+    Bouwconfigs, saved configuration, the Bouwfiles and subdirectories
+    listed by the :class:`.ProjectWalker`, Bouwer code and command line
+    arguments. If the fingerprint did not change, the next run executes
+    the saved actions without parsing any Bouwfile. Builders must search
+    for files with :func:`glob`, such that the saved actions are only
+    used while each pattern still matches the same files.
+
+    Actions can only be saved if their commands are shell commands or
+    methods of a plugin, and their tags are plain data. Discovered C
+    headers must come from a compiler depfile, which is read again
+    when the actions are loaded.
+    """
+
+    """ Command line arguments which do not influence the actions """
+    OUTPUT_ARGS = [ 'log', 'log_level', 'verbose', 'output_plugin', 'cache_stats', 'targets',
+                    'run_action', 'emit_ninja', 'export_plugin', 'workers', 'schedule',
+                    'rebuild_check', 'cache_max_size', 'cache_max_age', 'cache_sizes',
+                    'executor', 'no_jobserver', 'max_load', 'min_free_memory' ]
+
+    def __init__(self, manager):
+        """
+        Constructor
+        """
+        self.manager = manager
+        self.conf    = manager.conf
+        self.cache   = bouwer.util.Cache.Instance('graph')
+        self.log     = logging.getLogger(__name__)
+        self.digest  = None
+        self.globs   = {}
+
+    def glob(self, pattern):
+        """
+        Return the files matching `pattern`, and remember the result
+        """
+        found = glob.glob(pattern)
+        self.globs[os.path.abspath(pattern)] = sorted([ os.path.abspath(f) for f in found ])
+        return found
+
+    def fingerprint(self):
+        """
+        Compute a digest of everything the actions are generated from
+        """
+        if self.digest is not None:
+            return self.digest
+
+        walker = bouwer.util.ProjectWalker.Instance()
+        stats  = bouwer.util.StatCache.Instance()
+        files  = walker.walk('.', 'Bouwfile') + \
+                 walker.walk('.', 'Bouwconfig') + \
+                 walker.walk(self.conf.base_conf, 'Bouwconfig') + \
+                 [ '.bouwconf' ]
+
+        # Bouwer itself and all plugins
+        modules = [ module for name, module in list(sys.modules.items())
+                           if name.startswith('bouwer') ]
+
+        for plugin in bouwer.plugin.PluginManager.Instance().plugins.values():
+            modules.append(sys.modules[plugin.__class__.__module__])
+
+        for module in modules:
+            if getattr(module, '__file__', None):
+                files.append(module.__file__)
+
+        lines = []
+        for filename in sorted(set(files)):
+            st = stats.stat(filename)
+            lines.append(filename + ' ' + (str((st.st_mtime, st.st_size)) if st else '-'))
+
+        # Directory listings. Outputs written in-tree do not change these.
+        for path, listing in sorted(walker.listings.items()):
+            lines.append(path + ' ' + repr(listing))
+
+        # Command line arguments
+        for key, value in sorted(vars(self.conf.args).items()):
+            if key in self.OUTPUT_ARGS:
+                continue
+            if not bouwer.util.is_plain(value):
+                value = value.__class__.__name__
+            lines.append(key + '=' + repr(value))
+
+        self.digest = hashlib.md5('\n'.join(lines).encode('utf-8')).hexdigest()
+        return self.digest
+
+    def save(self, target, tree, rounds):
+        """
+        Save the rounds of actions executed for `target` in `tree`
+        """
+        key    = tree.name + ':' + target
+        plugins = bouwer.plugin.PluginManager.Instance().plugins
+        result = []
+
+        for actions in rounds:
+            records = []
+
+            for action in actions:
+                builder = action.builder.__class__.__name__
+                command = action.command
+
+                if plugins.get(builder) is not action.builder or \
+                   not bouwer.util.is_plain(action.tags) or \
+                   ('implicit' in action.tags and 'depfile' not in action.tags):
+                    self.log.debug('not saving actions of ' + key + ': ' + action.target)
+                    self.cache.put(key, None)
+                    return
+
+                # Methods of plugins are saved by name
+                if callable(command):
+                    owner = getattr(command, '__self__', None)
+                    if owner is None or plugins.get(owner.__class__.__name__) is not owner:
+                        self.log.debug('not saving actions of ' + key + ': ' + action.target)
+                        self.cache.put(key, None)
+                        return
+                    command = (owner.__class__.__name__, command.__name__)
+
+                records.append((action.target, list(action.sources),
+                                command, action.tags, builder))
+            result.append(records)
+
+        self.cache.put(key, (self.fingerprint(), result, self.globs))
+
+    def load(self, target, tree):
+        """
+        Load the saved rounds of actions for `target` in `tree`
+
+        Returns a list of rounds, each a list of (target, sources,
+        command, tags, builder) tuples, or `None` if the actions must be
+        generated again.
+        """
+        entry = self.cache.get(tree.name + ':' + target)
+
+        if entry is None or entry[0] != self.fingerprint():
+            return None
+
+        # Files may have been added or removed since
+        for pattern, found in entry[2].items():
+            if sorted(glob.glob(pattern)) != found:
+                self.log.debug('files matching ' + pattern + ' changed')
+                return None
 
-        # Execute the target routine, if defined in this Bouwfile.
-        if target in globs:
-            globs[target](self.manager.conf.active_tree)
+        plugins = bouwer.plugin.PluginManager.Instance().plugins
+        stats   = bouwer.util.StatCache.Instance()
+        rounds  = []
+
+        try:
+            for records in entry[1]:
+                actions = []
+
+                for target, sources, command, tags, builder in records:
+                    tags = copy.deepcopy(tags)
+
+                    if isinstance(command, tuple):
+                        command = getattr(plugins[command[0]], command[1])
+
+                    # Headers may have changed since the last compile
+                    if 'depfile' in tags:
+                        implicit = set(tags.get('implicit', []))
+                        explicit = [ src for src in sources if src not in implicit ]
+
+                        if stats.exists(tags['depfile']):
+                            headers = self._read_depfile(tags['depfile'])
+                        elif not stats.exists(target):
+                            headers = []
+                        else:
+                            return None
+
+                        tags['implicit'] = [ hdr for hdr in headers if hdr not in explicit ]
+                        sources = tags['implicit'] + explicit
+
+                    actions.append((target, sources, command, tags, plugins[builder]))
+                rounds.append(actions)
+
+        except (KeyError, AttributeError, IOError):
+            return None
+
+        return rounds
+
+    def _read_depfile(self, filename):
+        """
+        Read the dependencies of the first rule in a make style depfile
+        """
+        rule = open(filename).read().replace('\\\n', ' ').split('\n')[0]
+        return rule.partition(':')[2].split()
 
 class BuilderManager(bouwer.util.Singleton):
     """ 
@@ -382,6 +586,9 @@ class BuilderManager(bouwer.util.Singleton):
         self.args      = self.conf.args
         self.log       = logging.getLogger(__name__)
         self.parser    = BuilderParser(self)
+        self.deferred  = []
+        self.rounds    = []
+        self.graph     = ActionGraph(self)
 
     def execute(self, target, tree):
         """ 
@@ -397,16 +604,69 @@ class BuilderManager(bouwer.util.Singleton):
 
         self.log.debug("executing build target: `" + tree.name + ':' + target + "'")
         self.actions = bouwer.action.ActionManager()
+        self.rounds  = []
+        self.graph.globs = {}
+
+        # Run the saved actions instead, if nothing changed since
+        if not self.conf.args.clean:
+            rounds = self.graph.load(target, tree)
+
+            if rounds is not None:
+                self.log.debug("using saved actions for `" + tree.name + ':' + target + "'")
+                for actions in rounds:
+                    for target_path, sources, command, tags, builder in actions:
+                        self._make_dir(target_path)
+                        self._make_dir(tags.get('depfile', ''))
+                        self.actions.submit(target_path, sources, command, tags, builder)
+                    self.actions.run()
+                return
 
         # Let the mesh execute its builders, and run its actions
         mesh = self.parser.parse('.', target)
 
         if mesh.instances:
             mesh.execute()
+
+            # Only a successful build is worth replaying
+            if not self.conf.args.clean and not self.actions.failed:
+                self.graph.save(target, tree, self.rounds)
         else:
             self.log.error('no such target: ' + str(target))
             sys.exit(1)
 
+    def _make_dir(self, target):
+        """
+        Create the directory of the `target` file, if needed
+        """
+        dirname = os.path.dirname(target)
+        stats   = bouwer.util.StatCache.Instance()
+
+        if len(dirname) > 0 and not stats.exists(dirname):
+            os.makedirs(dirname)
+            stats.invalidate(dirname)
+
+    def defer(self, function):
+        """
+        Postpone calling `function` until the actions of this round run
+
+        Builders may use this to register actions when work running
+        in the background, like dependency scanning, is done. The active
+        builder and directory are restored before the `function` is called.
+        """
+        self.deferred.append((function, self.parser.mesh.active_instance,
+                              self.conf.active_dir))
+
+    def run_deferred(self):
+        """
+        Call all postponed functions in order
+        """
+        deferred, self.deferred = self.deferred, []
+
+        for function, instance, active_dir in deferred:
+            self.parser.mesh.active_instance = instance
+            self.conf.active_dir = active_dir
+            function()
+
     def action(self, target, sources, command, **tags):
         """ 
         Callback from builders to generate an Action
@@ -427,10 +687,8 @@ class BuilderManager(bouwer.util.Singleton):
 
         # TODO: measure what is the best place to put this: inside the worker,
         # or here at the master?
-        dirname = os.path.dirname(target.absolute)
-        
-        if len(dirname) > 0 and not os.path.exists(dirname):
-            os.makedirs(dirname)
+        self._make_dir(target.absolute)
+        self._make_dir(tags.get('depfile', ''))
 
         self.actions.submit(target.absolute, src_list, command, tags,
                             self.parser.mesh.active_instance.builder)
@@ -49,9 +49,19 @@ class CommandLine(bouwer.util.Singleton):
         self.parser.add_argument('-L', '--log-level', help='Set the logging level', type=str, default='WARNING', choices = [ 'DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL' ])
         self.parser.add_argument('-v', '--verbose', help='alias for -L DEBUG', action='store_true', default=False)
         self.parser.add_argument('-f', '--force', help='Force a rebuild of all targets', action='store_true', default=False)
+        self.parser.add_argument('--rebuild-check', help='Compare the timestamp and/or content of sources to decide if a target is up-to-date', type=str, default='mtime', choices = [ 'mtime', 'hash', 'mtime+hash' ])
+        self.parser.add_argument('--run-action', help='Only execute the action of the given target file', metavar='FILE', type=str, default=None)
         self.parser.add_argument('-c', '--clean', help='Remove all targets and generated dependencies', action='store_true', default=False)
         self.parser.add_argument('-P', '--plugin-dir', help='Directory containing plugins', type=str, default='bouw_plugins')
         self.parser.add_argument('-w', '--workers', help='Number of worker processes to start', type=int, default=multiprocessing.cpu_count())
+        self.parser.add_argument('--executor', help='Run actions in worker processes or on an asyncio event loop', type=str, default='process', choices = [ 'process', 'async' ])
+        self.parser.add_argument('--no-jobserver', help='Do not share the workers with nested builds using the GNU make jobserver', action='store_true', default=False)
+        self.parser.add_argument('--max-load', help='Do not start new actions while the load average is above LOAD', metavar='LOAD', type=float, default=0)
+        self.parser.add_argument('--min-free-memory', help='Do not start new actions while less than MB megabytes of memory are available', metavar='MB', type=int, default=0)
+        self.parser.add_argument('--cache-max-size', help='Maximum size in bytes of each cache, or 0 for no limit', type=int, default=64 * 1024 * 1024)
+        self.parser.add_argument('--cache-max-age', help='Remove cache entries not used for the given number of days, or 0 to keep them', type=int, default=30)
+        self.parser.add_argument('--cache-stats', help='Output the usage of each cache after executing', action='store_true', default=False)
+        self.parser.add_argument('--schedule', help='Order in which ready actions are executed', type=str, default='critical-path', choices = [ 'critical-path', 'fifo' ])
         self.parser.add_argument('targets', metavar='TARGET', type=str, nargs='*', default=['build'], help='Build targets to execute')
 
         # Allow the user to override the default arguments using RC files
@@ -114,3 +124,12 @@ class CommandLine(bouwer.util.Singleton):
         # Set defaults
         self.parser.set_defaults(**user_args)
 
+        # Maximum sizes of specific caches, in bytes
+        cache_sizes = {}
+        if rc.has_section('cache'):
+            for name, value in rc.items('cache'):
+                if name not in rc.defaults():
+                    cache_sizes[name] = int(value)
+
+        self.parser.set_defaults(cache_sizes = cache_sizes)
+
@@ -729,20 +729,7 @@ class Configuration(bouwer.util.Singleton):
         """
         Scans a directory for Bouwconfig files
         """
-        found = False
-
-        # Look for all Bouwconfig's.
-        for filename in os.listdir(dirname):
-            # TODO: replace 'Bouwconfig' literal with a constant, e.g. BOUWCONF or something or CONFFILE
-            if filename.endswith('Bouwconfig'):
-                self.active_dir = dirname
-                self.parser.parse(dirname + os.sep + filename)
-                found = True
-
-        # Only scan subdirectories if at least one Bouwconfig found.
-        if found:        
-            for filename in os.listdir(dirname):
-                if os.path.isdir(dirname + os.sep + filename):
-                    self._scan_dir(dirname + os.sep + filename)
-
-
+        # TODO: replace 'Bouwconfig' literal with a constant, e.g. BOUWCONF or something or CONFFILE
+        for filename in bouwer.util.ProjectWalker.Instance().walk(dirname, 'Bouwconfig'):
+            self.active_dir = os.path.dirname(filename)
+            self.parser.parse(filename)
@@ -28,6 +28,7 @@ import bouwer.plugin
 import bouwer.config
 import bouwer.builder
 import bouwer.action
+import bouwer.util
 
 def execute():
     """
@@ -68,6 +69,11 @@ def execute():
     # BUT: buildermanager also needs the final conf.args...
     
     conf.args = cli.parse()
+
+    # Apply the limits of the caches
+    bouwer.util.Cache.Configure(conf.args.cache_max_size,
+                                conf.args.cache_max_age,
+                                conf.args.cache_sizes)
     # TODO: the default output plugin is PrettyOutput... wrong location to do it here.
     try:
         getattr(conf.args, 'output_plugin')
@@ -84,21 +90,39 @@ def execute():
     if conf_plugin is not None:
         sys.exit(conf_plugin.configure(conf))
 
-    # Execute each target in turn.
-    for target in conf.args.targets:
-
-        # TODO: generate an error if no targets are executed.
-
-        # TODO: execute tree's in parallel?
-        # Traverse Bouwfiles for each custom tree
-        if len(conf.trees) > 1:
-            for tree_name, tree in conf.trees.items():
-                if tree_name != 'DEFAULT':
-                    build.execute(target, tree)
+    # Share the workers with nested builds
+    jobs = bouwer.action.JobServer.Instance()
 
-        # Use the default tree
-        else:
-            build.execute(target, conf.trees.get('DEFAULT'))
+    try:
+        # Execute each target in turn.
+        for target in conf.args.targets:
+
+            # TODO: generate an error if no targets are executed.
+
+            # TODO: execute tree's in parallel?
+            # Traverse Bouwfiles for each custom tree
+            if len(conf.trees) > 1:
+                for tree_name, tree in conf.trees.items():
+                    if tree_name != 'DEFAULT':
+                        build.execute(target, tree)
+
+            # Use the default tree
+            else:
+                build.execute(target, conf.trees.get('DEFAULT'))
+
+        # The action to run was not found
+        if conf.args.run_action:
+            logging.getLogger(__name__).error('no such action: ' + conf.args.run_action)
+            sys.exit(1)
+    finally:
+        for executor in bouwer.action.EXECUTORS.values():
+            executor.Instance().shutdown()
+        jobs.shutdown()
 
     # Flush all caches
     bouwer.util.Cache.FlushAll()
+    bouwer.util.StatCache.Instance().report()
+    bouwer.action.Throttle.Instance().report()
+
+    if conf.args.cache_stats:
+        print(bouwer.util.Cache.Report())
@@ -17,7 +17,6 @@
 
 import os
 import os.path
-import glob
 import random
 import sys
 import tarfile
@@ -97,7 +96,10 @@ class Archive(Plugin):
 
             exc_list = [ target ]
             for exc in exclude:
-                exc_list += glob.glob(exc)
+                exc_list += self.build.graph.glob(exc)
+
+            # Remembers whether the include exists
+            matches = self.build.graph.glob(inc)
 
             # Is the include a directory?
             if os.path.isdir(inc) :
@@ -109,7 +111,7 @@ class Archive(Plugin):
 
             # include is a pattern
             else:
-                for f in glob.glob(inc):
+                for f in matches:
                     if os.path.isdir(f):
                         filelist += self.get_filelist(target, f, include, exclude)
                     elif f not in exc_list:
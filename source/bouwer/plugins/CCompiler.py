@@ -19,7 +19,10 @@ import os
 import os.path
 import glob
 import copy
+import re
+import shlex
 import subprocess
+import concurrent.futures
 from bouwer.plugin import *
 from bouwer.builder import *
 from bouwer.config import *
@@ -212,8 +215,127 @@ class Include(Plugin):
                 else:
                     cc._keywords['incpath'] = inc
 
+class IncludeScanner:
+    """
+    Find headers included by C files without the C preprocessor
+
+    Both quoted and angle includes are resolved against the include
+    path. Quoted includes are first searched for in the directory of the
+    including file. Headers which cannot be found, like system headers,
+    are skipped. Conditional includes are always followed, such that the
+    headers found may be more than actually needed.
+
+    The includes of each header are parsed only once and the
+    transitive set of headers of each header is remembered.
+    """
+
+    INCLUDE = re.compile(r'^[ \t]*#[ \t]*include[ \t]*([<"])([^>"]+)[>"]', re.MULTILINE)
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.direct     = {}
+        self.transitive = {}
+        self.stats      = bouwer.util.StatCache.Instance()
+
+    def scan(self, source, incpath):
+        """
+        Find all headers included by the C file `source`
+
+        :param str source: path to the C file
+        :param list incpath: directories to search for headers
+        """
+        incpath = tuple(incpath)
+        found   = set()
+
+        for header in self._includes(source, incpath):
+            found.add(header)
+            found.update(self._closure(header, incpath))
+
+        found.discard(source)
+        return sorted(found)
+
+    def _closure(self, header, incpath):
+        """
+        Find all headers included directly or indirectly by `header`
+        """
+        key = (header, incpath)
+        if key not in self.transitive:
+            self._visit(header, incpath, {}, [])
+        return self.transitive[key]
+
+    def _visit(self, path, incpath, index, stack):
+        """
+        Remember the headers included by `path` and the headers it includes
+
+        Headers which include each other share the same set of headers.
+        These groups are found with Tarjan's strongly connected components
+        algorithm. Returns the lowest index of a header reachable from `path`.
+        """
+        index[path] = low = len(index)
+        stack.append(path)
+
+        for header in self._includes(path, incpath):
+            if (header, incpath) in self.transitive:
+                continue
+            elif header not in index:
+                low = min(low, self._visit(header, incpath, index, stack))
+            elif header in stack:
+                low = min(low, index[header])
+
+        # Is this the first header of a group including each other?
+        if low == index[path]:
+            group = []
+            while not group or group[-1] != path:
+                group.append(stack.pop())
+
+            found = set()
+            for member in group:
+                for header in self._includes(member, incpath):
+                    found.add(header)
+                    if header not in group:
+                        found.update(self.transitive[(header, incpath)])
+
+            found = frozenset(found)
+            for member in group:
+                self.transitive[(member, incpath)] = found
+
+        return low
+
+    def _includes(self, path, incpath):
+        """
+        Find the headers included directly by `path`
+        """
+        key = (path, incpath)
+        if key in self.direct:
+            return self.direct[key]
+
+        headers = []
+        try:
+            text = open(path).read()
+        except (IOError, UnicodeDecodeError):
+            text = ''
+
+        for kind, name in self.INCLUDE.findall(text):
+            dirs = list(incpath)
+            if kind == '"':
+                dirs.insert(0, os.path.dirname(path))
+
+            for dirname in dirs:
+                candidate = os.path.normpath(os.path.join(dirname, name))
+                if self.stats.exists(candidate):
+                    headers.append(candidate)
+                    break
+
+        self.direct[key] = headers
+        return headers
+
 class CCompiler(bouwer.util.Singleton):
 
+    """ Commands with these characters need a shell """
+    SHELL = re.compile(r'[|&;<>()$`*?~#\[\]{}\n]')
+
     def __init__(self):
         """
         Constructor
@@ -224,48 +346,135 @@ class CCompiler(bouwer.util.Singleton):
         self.libraries  = {}
         self.use_libraries = {}
         self.objects_for_items = {}
+        self.scanner = None
+        self.includes = IncludeScanner()
 
-    def _find_headers(self, source, incflags, cc):
+    def _find_headers(self, source, outfile, depfile = None):
         """
-        Find headers included by a C file using the C preprocessor.
-        Return them as a list.
+        Find headers included by a C file.
+        Return them as a list, or `None` if the C file must be scanned.
+
+        If the object file does not exist yet, it will be compiled anyway
+        and no headers are needed. Otherwise the headers are read from the
+        `depfile` written by the compiler at the last compile, if any.
+        Only without a depfile the headers found by an earlier scan are used,
+        as long as neither the C file nor any of its headers changed.
         """
+        stats = bouwer.util.StatCache.Instance()
 
-        # TODO: make this recursive
+        if not stats.exists(outfile.absolute):
+            return []
 
-        # Retrieve cache and file stat
-        cache = bouwer.util.Cache.Instance('c_headers')
-        st = os.stat(source.absolute)
-        headers = []
-        headers_str = []
+        if depfile is not None and stats.exists(depfile):
+            try:
+                return self._parse_depends(source, open(depfile).read())
+            except IOError:
+                pass
+
+        # Each entry holds the C file and header modification times at the scan
+        try:
+            stamp, headers = bouwer.util.Cache.Instance('c_headers').get(source.absolute)
+        except (TypeError, ValueError):
+            return None
 
-        # Do we have the file still in an up-to-date cache?
-        if cache.timestamp() >= st.st_mtime and cache.get(source.absolute) is not None:
-            for hdr in cache.get(source.absolute):
-                sp = SourcePath('')
-                sp.absolute = hdr
-                headers.append(sp)
-            return headers
+        if stamp != self._stamp(source.absolute):
+            return None
+
+        for hdr, mtime in headers:
+            st = stats.stat(hdr)
+            if st is None or st.st_mtime != mtime:
+                return None
+
+        return [ hdr for hdr, mtime in headers ]
+
+    def _command(self, *parts):
+        """
+        Make a command from the given parts of a command line
+
+        Return a `list` of arguments to execute directly, or
+        a `str` for the shell if the command needs one.
+        """
+        text = ' '.join(parts)
+
+        if self.SHELL.search(text):
+            return text
+        try:
+            return shlex.split(text)
+        except ValueError:
+            return text
+
+    def _stamp(self, path):
+        """
+        Return the modification time and size of a file, or `None`
+        """
+        st = bouwer.util.StatCache.Instance().stat(path)
+        return (st.st_mtime, st.st_size) if st is not None else None
+
+    def _remember_headers(self, source, headers):
+        """
+        Store the headers found by scanning a C file in the `c_headers` cache
+        """
+        stats = bouwer.util.StatCache.Instance()
+        entry = []
+
+        for hdr in headers:
+            st = stats.stat(hdr)
+            entry.append((hdr, st.st_mtime if st is not None else None))
+
+        bouwer.util.Cache.Instance('c_headers').put(source.absolute,
+                                                    (self._stamp(source.absolute), entry))
+
+    def _scan_headers(self, source, incflags, cc):
+        """
+        Find headers included by a C file using the C preprocessor.
+        Return them as a list.
+
+        Runs on a thread of the header scanner pool. The caller must
+        remember the headers found on the main thread, since the caches
+        are not thread safe.
+        """
+        headers = []
 
         # Invoke the preprocessor to determine header dependencies
         try:
-            cpp_command=cc['cpp'] + ' ' + incflags + ' ' + cc['cppflags'] + ' ' + source.absolute
-            result = str(subprocess.check_output(cpp_command, stderr=subprocess.PIPE, shell=True))
-
-            header_list = result.replace(' \\\n', '').strip().split(' ')
-            headers_str = header_list[2:]
-
-            for header in headers_str:
-                if header:
-                    sp = SourcePath('')
-                    sp.absolute = header
-                    headers.append(sp)
-        except subprocess.CalledProcessError:
+            cpp_command = self._command(cc['cpp'], incflags, cc['cppflags'], source.absolute)
+            result = subprocess.check_output(cpp_command, stderr=subprocess.PIPE,
+                                             shell=isinstance(cpp_command, str))
+            headers = self._parse_depends(source, result.decode('utf-8', 'replace'))
+        except (subprocess.CalledProcessError, OSError):
             pass
 
-        cache.put(source.absolute, headers_str)
         return headers
 
+    def _scan_builtin(self, source, incpath):
+        """
+        Find headers included by a C file using the :class:`IncludeScanner`.
+        Return them as a list.
+        """
+        headers = self.includes.scan(source.absolute, incpath)
+        self._remember_headers(source, headers)
+        return headers
+
+    def _parse_depends(self, source, text):
+        """
+        Read the headers of a C file from make style dependencies.
+        Return them as a list.
+        """
+
+        # Only the first rule lists the dependencies of the object
+        rule = text.replace('\\\n', ' ').split('\n')[0]
+
+        return [ hdr for hdr in rule.partition(':')[2].split()
+                     if hdr != source.absolute ]
+
+    def _scanner(self):
+        """
+        Retrieve the thread pool for scanning C files
+        """
+        if self.scanner is None:
+            self.scanner = concurrent.futures.ThreadPoolExecutor(self.conf.args.workers)
+        return self.scanner
+
     def _find_config_deps(self, item):
         dep_list = [ item ]
         for dep in item.get_key('depends', []):
@@ -320,6 +529,7 @@ class CCompiler(bouwer.util.Singleton):
 
         # Translate source and target paths relative from project-root
         outfile = TargetPath(splitfile[0] + '.o')
+        depfile = None
 
         # Fill compiler command
         if splitfile[1] == '.c' or splitfile[1] == '.S':
@@ -336,32 +546,64 @@ class CCompiler(bouwer.util.Singleton):
             self.c_object_list.append(outfile)
 
         # Add C preprocessor paths
-        incpath = cc.get_key('incpath', '').split(':') + chain.get_key('incpath', '').split(':')
-        for path in incpath:
-            if path: incflags += cc['incflag'] + path + ' '
+        incpath = [ p for p in cc.get_key('incpath', '').split(':') +
+                               chain.get_key('incpath', '').split(':') if p ]
 
         # Add C preprocessor paths from libraries
         for libname in self._get_libraries_for_target(outfile):
             try:
-                incflags += cc['incflag'] + self.libraries[self.conf.active_tree][libname][1] + ' '
+                incpath.append(self.libraries[self.conf.active_tree][libname][1])
             except KeyError:
                 pass
 
-        # Determine dependencies to build output file.
-        deps = self._find_headers(source, incflags, cc) + depends
-        deps.append(source)
+        for path in incpath:
+            incflags += cc['incflag'] + path + ' '
+
+        # Let the compiler write the header dependencies, if supported.
+        # Depfiles are kept out of the source tree.
+        depflags = cc.get_key('depflags', '')
+        if depflags:
+            depfile = bouwer.util.tempfile('deps' + os.sep + os.path.splitext(outfile.absolute)[0] + '.d')
+            depflags += ' ' + depfile + ' '
+            extra_tags['depfile'] = depfile
 
         # Set our pretty name
         if 'pretty_name' not in extra_tags:
             extra_tags['pretty_name'] = 'CC'
 
-        # Register compile action
-        self.build.action(outfile, deps,
-                          compiler + ' ' + incflags + str(source),
-                        **extra_tags
-        )
+        command = self._command(compiler, depflags + incflags + str(source))
+
+        # Determine dependencies to build output file. The C preprocessor
+        # runs in the background. The action is registered when it is done.
+        headers = self._find_headers(source, outfile, depfile)
+
+        if headers is None and cc.get_key('depscan', 'cpp') == 'builtin':
+            headers = self._scan_builtin(source, incpath)
+
+        if headers is None:
+            scan = self._scanner().submit(self._scan_headers, source, incflags, cc)
+            self.build.defer(lambda: self._add_scanned(outfile, source, scan.result(),
+                                                       depends, command, extra_tags))
+        else:
+            self._add_object(outfile, source, headers, depends, command, extra_tags)
+
         return outfile
 
+    def _add_scanned(self, outfile, source, headers, depends, command, tags):
+        """
+        Remember the headers found by the C preprocessor and register
+        the action to compile a C source file
+        """
+        self._remember_headers(source, headers)
+        self._add_object(outfile, source, headers, depends, command, tags)
+
+    def _add_object(self, outfile, source, headers, depends, command, tags):
+        """
+        Register the action to compile a C source file
+        """
+        tags['implicit'] = headers
+        self.build.action(outfile, headers + depends + [ source ], command, **tags)
+
     def c_program(self, target, sources, item = None, depends = [], **extra_tags):
         """
         Build an program given its `target` name and `sources` list
@@ -414,9 +656,9 @@ class CCompiler(bouwer.util.Singleton):
 
         # Link the program
         self.build.action(target, objects + extra_deps,
-                          link + ' ' + str(target) + ' ' +
-                         (' '.join([str(o) for o in objects])) + ' ' + ldpath +
-                          ldflags + ' ' + cc['ldscript'],
+                          self._command(link, str(target),
+                                        ' '.join([str(o) for o in objects]),
+                                        ldpath + ldflags, cc['ldscript']),
                          **extra_tags)
 
         # Clear list of objects
@@ -442,9 +684,8 @@ class CCompiler(bouwer.util.Singleton):
 
         # Generate action for linking the library
         self.build.action(target, extra_deps,
-                          cc['ar'] + ' ' +
-                          cc['arflags'] + ' ' + str(target) + ' ' +
-                        (' '.join([str(o) for o in extra_deps])),
+                          self._command(cc['ar'], cc['arflags'], str(target),
+                                        ' '.join([str(o) for o in extra_deps])),
                           pretty_name='LIB')
 
         # Clear C object list
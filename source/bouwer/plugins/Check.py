@@ -47,28 +47,31 @@ class CheckOS(Plugin):
         os_file = bouwer.util.tempfile(self.__class__.__name__ + '.' + conf.name)
 
         self.build.action(TargetPath(os_file), [],
-                         '# CheckOS',
+                          self.action_run,
                           pretty_name='Checking for',
                           pretty_target='Operating System',#conf.name,
                           confitem=conf)
 
-    def action_event(self, action, event):
+    def action_run(self, action):
         """
-        Called when an Action has finished
+        Determine the operating system and update the configuration item
+
+        Runs on a thread of the main process, such that
+        the configuration item can be updated directly.
         """
-        # TODO: this is not parallel. Python function should be used
-        #       so it can be parallel. But the python function should be
-        #       able to modify the Config object. We need threads for parallizing
-        #       with python functions then.
+        item = action.tags['confitem']
 
-        # Update the configuration item
-        if event.type == ActionEvent.FINISH:
-            open(action.target, 'w').close()
-            item = action.tags['confitem']
+        for name in self.os_dict:
+            if sys.platform.startswith(name):
+                item.update(self.os_dict[name])
+                break
 
-            for os in self.os_dict:
-                if sys.platform.startswith(os):
-                    item.update(self.os_dict[os])
-                    break
+        open(action.target, 'w').close()
+        return 0
 
-            action.tags['pretty_target'] += ' ... ' + item.value()
+    def action_event(self, action, event):
+        """
+        Called when an Action has finished
+        """
+        if event.type == ActionEvent.FINISH:
+            action.tags['pretty_target'] += ' ... ' + str(action.tags['confitem'].value())
@@ -0,0 +1,134 @@
+#
+# Copyright (C) 2012 Niek Linnenbank
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import sys
+from bouwer.plugin import *
+
+class ExportNinja(Plugin):
+    """
+    Write actions to a Ninja build file instead of executing them
+
+    Actions of builders which produce configuration are still executed,
+    as later actions may depend on it. Python functions are written as
+    invocations of ``bouw --run-action``.
+    """
+
+    def initialize(self):
+        """
+        Initialize plugin
+        """
+        self.edges = []
+        self.conf.cli.parser.add_argument('--emit-ninja',
+            dest    = 'emit_ninja',
+            metavar = 'FILE',
+            type    = str,
+            default = None,
+            help    = 'Write actions to the given Ninja build file instead of executing them')
+        self.conf.cli.parser.set_defaults(export_plugin = self)
+
+    def export_actions(self, actions):
+        """
+        Export the given actions
+
+        Returns the actions which must be executed anyway.
+        """
+        if not self.conf.args.emit_ninja:
+            return actions
+
+        execute = {}
+
+        for target, action in actions.items():
+            if action.builder.config_action_output():
+                execute[target] = action
+            else:
+                self.edges.append(action)
+
+        self.write(self.conf.args.emit_ninja)
+        return execute
+
+    def write(self, filename):
+        """
+        Write all exported actions to the Ninja file `filename`
+        """
+        bouw = os.path.abspath(sys.argv[0])
+        targets = ' '.join([ self._escape(t) for t in self.conf.args.targets ])
+
+        lines = [ '# Generated by Bouwer. Do not edit.',
+                  'ninja_required_version = 1.3',
+                  '',
+                  'rule command',
+                  '  command = $command',
+                  '  description = $description',
+                  '',
+                  'rule depfile',
+                  '  command = $command',
+                  '  description = $description',
+                  '  depfile = $depfile',
+                  '',
+                  'rule action',
+                  '  command = ' + self._escape(bouw) + ' -q --run-action $out ' + targets,
+                  '  description = $description',
+                  '' ]
+
+        for action in self.edges:
+            implicit = action.tags.get('implicit', [])
+            explicit = [ src for src in action.sources if src not in implicit ]
+
+            # Headers are read from the depfile by Ninja
+            if 'depfile' in action.tags:
+                rule = 'depfile'
+                implicit = []
+            else:
+                rule = 'command'
+
+            if callable(action.command):
+                rule = 'action'
+
+            edge = 'build ' + self._escape_path(action.target) + ': ' + rule
+            for src in explicit:
+                edge += ' ' + self._escape_path(src)
+            if implicit:
+                edge += ' |'
+                for src in implicit:
+                    edge += ' ' + self._escape_path(src)
+            lines.append(edge)
+
+            if rule != 'action':
+                lines.append('  command = ' + self._escape(action.command_line()))
+            if rule == 'depfile':
+                lines.append('  depfile = ' + self._escape(action.tags['depfile']))
+
+            lines.append('  description = ' + self._escape(
+                         action.tags.get('pretty_name', action.builder.__class__.__name__) + ' ' +
+                         action.tags.get('pretty_target', action.target)))
+            lines.append('')
+
+        with open(filename, 'w') as fp:
+            fp.write('\n'.join(lines))
+
+    def _escape(self, text):
+        """
+        Escape text for use in a Ninja variable
+        """
+        return text.replace('$', '$$').replace('\n', ' ')
+
+    def _escape_path(self, path):
+        """
+        Escape a path for use in a Ninja build statement
+        """
+        return self._escape(path).replace(' ', '$ ').replace(':', '$:')
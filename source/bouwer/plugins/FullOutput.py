@@ -40,4 +40,4 @@ class FullOutput(Plugin):
     #
     def action_event(self, action, event):
         if event.type == ActionEvent.FINISH:
-            print(str(event.worker) + ' : ' + str(action.command))
+            print(str(event.worker) + ' : ' + action.command_line())
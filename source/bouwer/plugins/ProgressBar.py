@@ -43,10 +43,15 @@ class ProgressBar(Plugin):
         Called when an :class:`.ActionEvent` is triggered
         """
         if event.type == ActionEvent.FINISH:
-            todo  = len(self.build.actions.workers.pending) + len(self.build.actions.workers.running)
-            total = len(self.build.actions.actions)
-            perc  = float(total - todo) / float(total)
-            self.update_progress(perc, action.target)
+            done, eta = self.build.actions.workers.progress()
+            label = action.target
+
+            # Show the estimated time left, if known from earlier builds
+            if eta is not None:
+                minutes, seconds = divmod(int(round(eta)), 60)
+                label = 'ETA {0}:{1:02d} {2}'.format(minutes, seconds, label)
+
+            self.update_progress(done, label)
 
     def get_console_width(self):
         """
@@ -58,7 +63,7 @@ class ProgressBar(Plugin):
             return term.columns
         except:
             try:
-                return os.environ['COLUMNS']
+                return int(os.environ['COLUMNS'])
             except:
                 hw = struct.unpack('hh', fcntl.ioctl(1, termios.TIOCGWINSZ, '1234'))
                 return hw[1]
@@ -17,9 +17,17 @@
 
 import json
 import collections
+import fcntl
+import hashlib
+import importlib.util
 import logging
+import marshal
+import mmap
 import os
 import pickle
+import stat
+import struct
+import time
 
 """
 Bouwer generic utilities
@@ -46,6 +54,19 @@ def tempfile(filename):
         os.mkdir(BOUWTEMP)
     return BOUWTEMP + '/' + filename
 
+def is_plain(value):
+    """
+    See if `value` only consists of plain data
+    """
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return True
+    elif isinstance(value, (list, tuple)):
+        return all([ is_plain(v) for v in value ])
+    elif isinstance(value, dict):
+        return all([ isinstance(k, str) and is_plain(v) for k, v in value.items() ])
+    else:
+        return False
+
 def compare_str(s1, s2):
     """
     Compare strings s1 and s1. Return the number of characters that are equal.
@@ -162,14 +183,129 @@ class AsciiDecoder(json.JSONDecoder):
                 # In Python 3.x all strings are unicode. Do not translate.
                 return data
 
+class StatCache(Singleton):
+    """
+    Process wide cache of :func:`os.stat` results
+
+    Paths are only stat'ed once. Files which are written afterwards,
+    for example the target of an :class:`.Action`, must be invalidated.
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.log     = logging.getLogger(__name__)
+        self.entries = {}
+        self.hits    = 0
+        self.misses  = 0
+
+    def stat(self, path):
+        """
+        Retrieve the :func:`os.stat` result for `path`
+
+        Returns `None` if the `path` does not exist.
+        """
+        try:
+            result = self.entries[path]
+            self.hits += 1
+            return result
+        except KeyError:
+            self.misses += 1
+
+        try:
+            result = os.stat(path)
+        except OSError:
+            result = None
+
+        self.entries[path] = result
+        return result
+
+    def exists(self, path):
+        """
+        See if `path` exists
+        """
+        return self.stat(path) is not None
+
+    def isdir(self, path):
+        """
+        See if `path` is an existing directory
+        """
+        result = self.stat(path)
+        return result is not None and stat.S_ISDIR(result.st_mode)
+
+    def invalidate(self, path):
+        """
+        Forget the cached result for `path`
+        """
+        self.entries.pop(path, None)
+
+    def clear(self):
+        """
+        Forget all cached results
+        """
+        self.entries.clear()
+
+    def report(self):
+        """
+        Write the hit rate of the cache to the debug log
+        """
+        total = self.hits + self.misses
+        rate  = float(self.hits) / total if total else 0.0
+        self.log.debug('StatCache : ' + str(self.hits) + ' hits, ' +
+                        str(self.misses) + ' misses ({0:.1%})'.format(rate))
+
 class Cache(object):
     """
     Generic caching implementation
+
+    Entries are kept in a read-only snapshot file, which is memory mapped
+    and searched lazily. The snapshot holds a table of fixed-width records
+    sorted by key, followed by the keys and pickled values. Changes since
+    the snapshot are appended to a log file, of which only the keys are
+    read when the cache is created. Values are unpickled on first use.
+    Once the log grows too large, both are merged into a new snapshot.
+
+    Each entry remembers when it was last used. Entries unused for longer
+    than the maximum age are removed, and the least recently used entries
+    are removed when the cache exceeds its maximum size.
+
+    Several processes may share the cache files, like the actions run
+    in parallel by another build tool. The files are locked while they
+    are written, and read again first if another process changed them.
     """
 
     """ List of Cache instances """
     instances = {}
 
+    """ Identifies the format of cache log files """
+    MAGIC = b'BOUWCACHE2\n'
+
+    """ Header of each log record: length of the key and value, last use """
+    RECORD = struct.Struct('<III')
+
+    """ Snapshot header: magic, number of entries and oldest last use """
+    HEADER = struct.Struct('<8sII')
+
+    """ Snapshot entry: offset and length of the key and value, last use """
+    ENTRY = struct.Struct('<IIIII')
+
+    """ Identifies the format of cache snapshot files """
+    SNAPSHOT = b'BOUWSNP2'
+
+    """ Minimum number of log records before the snapshot is rewritten """
+    COMPACT = 256
+
+    """ Seconds after which the last use of a read entry is recorded again """
+    TOUCH = 24 * 60 * 60
+
+    """ Default maximum size in bytes and age in days of each cache """
+    max_size = 0
+    max_age  = 0
+
+    """ Maximum size in bytes of specific caches """
+    sizes = {}
+
     def __init__(self, name):
         """
         Class constructor
@@ -177,15 +313,25 @@ class Cache(object):
         self.log = logging.getLogger(__name__)
         self.name = name
         self.data = {}
-        self.filename = tempfile(self.name + '.cache')
-
-        try:
-            self.fp = open(self.filename, 'rb+')
-            self.data = pickle.load(self.fp)
-        except (IOError, EOFError):
-            self.fp = open(self.filename, 'wb+')
-
-        self.stat = os.stat(self.filename)
+        self.index = {}
+        self.dirty = set()
+        self.touched = set()
+        self.buffer = b''
+        self.records = 0
+        self.size = 0
+        self.snapshot = None
+        self.identity = None
+        self.count = 0
+        self.oldest = 0
+        self.now = int(time.time())
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.filename = os.path.abspath(tempfile(self.name + '.cache'))
+        self.snapname = os.path.abspath(tempfile(self.name + '.snap'))
+        self.lockname = os.path.abspath(tempfile(self.name + '.lock'))
+        self._load_snapshot()
+        self._load()
         self.log.debug('Cache ' + self.name + ' : created')
 
     def __del__(self):
@@ -194,10 +340,9 @@ class Cache(object):
         """
         try:
             self.flush()
-            self.fp.close()
 
-        # Python 3.x seems to auto-close files
-        except ValueError:
+        # Modules may already be gone at interpreter shutdown
+        except (NameError, TypeError, AttributeError, IOError):
             pass
         self.log.debug('Cache ' + str(self.name) + ' : destroyed')
 
@@ -218,22 +363,578 @@ class Cache(object):
         """
         for inst in Cache.instances:
             Cache.instances[inst].flush()
-            Cache.instances[inst].fp.close()
 
-    def get(self, key):
+    @classmethod
+    def ClearAll(cls):
+        """
+        Forget the entries of all instances, after their files were removed
+        """
+        for inst in Cache.instances.values():
+            inst.clear()
+
+    @classmethod
+    def Configure(cls, max_size, max_age, sizes = {}):
+        """
+        Set the limits of all caches
+
+        :param int max_size: maximum size in bytes of each cache, or 0
+        :param int max_age: days after which unused entries are removed, or 0
+        :param dict sizes: maximum size in bytes of specific caches
+        """
+        Cache.max_size = max_size
+        Cache.max_age  = max_age
+        Cache.sizes    = dict(sizes)
+
+    @classmethod
+    def Report(cls):
+        """
+        Return a textual report of the usage of all caches
+        """
+        lines = [ '{0:<16} {1:>10} {2:>12} {3:>10} {4:>10} {5:>10}'.format(
+                  'cache', 'entries', 'bytes', 'hits', 'misses', 'evictions') ]
+
+        for name in sorted(Cache.instances):
+            inst = Cache.instances[name]
+            lines.append('{0:<16} {1:>10} {2:>12} {3:>10} {4:>10} {5:>10}'.format(
+                         name, inst.entries(), inst.bytes(), inst.hits,
+                         inst.misses, inst.evictions))
+
+        return '\n'.join(lines)
+
+    def _load_snapshot(self):
+        """
+        Memory map the snapshot file
+        """
+        if self.snapshot is not None:
+            self.snapshot.close()
+        self.snapshot = None
+        self.identity = self._identity()
+        self.count = 0
+        self.oldest = 0
+
         try:
-            return self.data[key]
-        except:
+            with open(self.snapname, 'rb') as fp:
+                snapshot = mmap.mmap(fp.fileno(), 0, access = mmap.ACCESS_READ)
+        except (IOError, ValueError):
+            return
+
+        # Older or damaged snapshots are ignored
+        try:
+            magic, count, oldest = self.HEADER.unpack_from(snapshot, 0)
+        except struct.error:
+            magic, count, oldest = None, 0, 0
+
+        if magic != self.SNAPSHOT or len(snapshot) < self.HEADER.size + count * self.ENTRY.size:
+            snapshot.close()
+            return
+
+        self.snapshot = snapshot
+        self.count = count
+        self.oldest = oldest
+
+    def _identity(self):
+        """
+        Return the inode and modification time of the snapshot file, or `None`
+        """
+        try:
+            st = os.stat(self.snapname)
+            return (st.st_ino, st.st_mtime_ns)
+        except OSError:
             return None
 
+    def _reload(self):
+        """
+        Read the cache files again if another process changed them
+
+        A new snapshot means another process compacted the cache.
+        Otherwise, the log only grows when other processes append to it.
+        Changes not yet flushed are kept.
+        """
+        try:
+            size = os.stat(self.filename).st_size
+        except OSError:
+            size = 0
+
+        if self._identity() == self.identity and size == self.size:
+            return
+
+        # Values of touched entries may be gone from the new files
+        self.dirty |= set([ key for key in self.touched if key in self.data ])
+        self.touched.clear()
+        self.data    = dict([ (key, self.data[key]) for key in self.dirty ])
+        self.index   = {}
+        self.buffer  = b''
+        self.records = 0
+        self.size    = 0
+        self._load_snapshot()
+        self._load()
+
+    def _lock(self):
+        """
+        Open and exclusively lock the lock file of this cache
+
+        The lock is released when the returned file is closed.
+        """
+        os.makedirs(os.path.dirname(self.lockname), exist_ok = True)
+        fp = open(self.lockname, 'a')
+        fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+        return fp
+
+    def _load(self):
+        """
+        Read the keys and value locations from the cache log file
+        """
+        try:
+            with open(self.filename, 'rb') as fp:
+                buf = fp.read()
+        except IOError:
+            return
+
+        # Older or damaged cache files are started over
+        if not buf.startswith(self.MAGIC):
+            return
+
+        offset = len(self.MAGIC)
+
+        while offset + self.RECORD.size <= len(buf):
+            keylen, vallen, used = self.RECORD.unpack_from(buf, offset)
+            start = offset + self.RECORD.size + keylen
+
+            # Skip the incomplete record of an interrupted flush
+            if start + vallen > len(buf):
+                break
+
+            key = buf[offset + self.RECORD.size:start].decode('utf-8')
+            self.index[key] = (start, vallen, used)
+            self.records += 1
+            offset = start + vallen
+
+        self.buffer = buf
+        self.size = offset
+
+    def _entry(self, num):
+        """
+        Return the key, value location and last use of entry `num` in the snapshot
+        """
+        koff, klen, voff, vlen, used = self.ENTRY.unpack_from(self.snapshot,
+                                           self.HEADER.size + num * self.ENTRY.size)
+        return self.snapshot[koff:koff + klen], voff, vlen, used
+
+    def _search(self, key):
+        """
+        Find the value location and last use of `key` in the snapshot, or `None`
+        """
+        key = key.encode('utf-8')
+        low, high = 0, self.count
+
+        while low < high:
+            mid = (low + high) // 2
+            probe, start, length, used = self._entry(mid)
+
+            if probe < key:
+                low = mid + 1
+            elif probe > key:
+                high = mid
+            else:
+                return start, length, used
+
+        return None
+
+    def _value(self, key):
+        """
+        Return the pickled current value of `key`
+        """
+        if key in self.dirty:
+            return pickle.dumps(self.data[key], pickle.HIGHEST_PROTOCOL)
+        elif key in self.index:
+            start, length, used = self.index[key]
+            return self.buffer[start:start + length]
+        else:
+            start, length, used = self._search(key)
+            return self.snapshot[start:start + length]
+
+    def _limit(self):
+        """
+        Return the maximum size in bytes of this cache, or 0
+        """
+        return Cache.sizes.get(self.name, Cache.max_size)
+
+    def _expired(self):
+        """
+        See if the snapshot contains entries older than the maximum age
+        """
+        return Cache.max_age > 0 and self.count > 0 and \
+               self.oldest < self.now - Cache.max_age * 24 * 60 * 60
+
+    def clear(self):
+        """
+        Forget all entries
+        """
+        if self.snapshot is not None:
+            self.snapshot.close()
+
+        self.snapshot = None
+        self.identity = None
+        self.count    = 0
+        self.oldest   = 0
+        self.data     = {}
+        self.index    = {}
+        self.buffer   = b''
+        self.records  = 0
+        self.size     = 0
+        self.dirty.clear()
+        self.touched.clear()
+
+    def entries(self):
+        """
+        Return the number of entries in the cache
+        """
+        extra = [ key for key in set(self.index) | self.dirty
+                      if self._search(key) is None ]
+        return self.count + len(extra)
+
+    def bytes(self):
+        """
+        Return the size in bytes of the cache files
+        """
+        return (len(self.snapshot) if self.snapshot is not None else 0) + self.size
+
+    def get(self, key):
+        try:
+            value = self.data[key]
+            self.hits += 1
+            return value
+        except KeyError:
+            pass
+
+        if key in self.index:
+            start, length, used = self.index[key]
+            value = pickle.loads(self.buffer[start:start + length])
+        else:
+            location = self._search(key)
+            if location is None:
+                self.misses += 1
+                return None
+            start, length, used = location
+            value = pickle.loads(self.snapshot[start:start + length])
+
+        # Remember the use of this entry, at most once a day
+        if used < self.now - self.TOUCH:
+            self.touched.add(key)
+
+        self.hits += 1
+        self.data[key] = value
+        return value
+
     def put(self, key, value):
         self.log.debug('Cache ' + self.name + ' : ' + key + ' => ' + str(value))
         self.data[key] = value
+        self.dirty.add(key)
 
     def flush(self):
-        pickle.dump(self.data, self.fp)
-        self.fp.flush()
+        """
+        Write the changed entries to the log, or compact the cache
+        """
+        limit = self._limit()
+
+        if not self.dirty and not self.touched and not self._expired() and \
+           not (limit and self.bytes() > limit) and \
+           self.records <= max(self.COMPACT, self.count // 2):
+            return
+
+        with self._lock():
+            self._reload()
+            self._flush()
+
+    def _flush(self):
+        """
+        Write the changed entries to the log. The cache must be locked.
+        """
+        changed = self.dirty | self.touched
+        limit   = self._limit()
+
+        if self.records + len(changed) > max(self.COMPACT, self.count // 2) or \
+           self._expired() or (limit and self.bytes() > limit):
+            self._compact()
+            return
+
+        if not changed:
+            return
+
+        start = self.size
+        chunk = []
+
+        if start == 0:
+            chunk.append(self.MAGIC)
+            self.size = len(self.MAGIC)
+            os.makedirs(os.path.dirname(self.filename), exist_ok = True)
+
+        for key in sorted(changed):
+            value = self._value(key)
+            raw   = key.encode('utf-8')
+            chunk.append(self.RECORD.pack(len(raw), len(value), self.now) + raw + value)
+            self.size += len(chunk[-1])
+            self.index[key] = (self.size - len(value), len(value), self.now)
+
+        chunk = b''.join(chunk)
+        self.buffer = self.buffer[:start] + chunk
+
+        # Overwrite an incomplete record left by an interrupted flush
+        with open(self.filename, 'rb+' if start else 'wb') as fp:
+            fp.seek(start)
+            fp.write(chunk)
+            fp.truncate()
+
+        self.records += len(changed)
+        self.dirty.clear()
+        self.touched.clear()
+
+        if limit and self.bytes() > limit:
+            self._compact()
+
+    def compact(self):
+        """
+        Merge the snapshot and the log into a new snapshot
+
+        Expired and least recently used entries are removed. The new
+        snapshot replaces the old one atomically, after which the log
+        is emptied.
+        """
+        with self._lock():
+            self._reload()
+            self._compact()
+
+    def _compact(self):
+        """
+        Merge the snapshot and the log into a new snapshot. The cache must be locked.
+        """
+        values = {}
+
+        for num in range(self.count):
+            key, start, length, used = self._entry(num)
+            values[key] = (self.snapshot[start:start + length], used)
+
+        for key in self.index:
+            values[key.encode('utf-8')] = (self._value(key), self.index[key][2])
+
+        for key in self.dirty | self.touched:
+            values[key.encode('utf-8')] = (self._value(key), self.now)
+
+        self._evict(values)
+
+        # Write the entry table followed by the keys and values
+        keys    = sorted(values)
+        offset  = self.HEADER.size + len(keys) * self.ENTRY.size
+        oldest  = min([ values[key][1] for key in keys ] or [ self.now ])
+        entries = [ self.HEADER.pack(self.SNAPSHOT, len(keys), oldest) ]
+        strings = []
+
+        for key in keys:
+            value, used = values[key]
+            entries.append(self.ENTRY.pack(offset, len(key), offset + len(key),
+                                           len(value), used))
+            strings += [ key, value ]
+            offset += len(key) + len(value)
+
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot = None
+
+        os.makedirs(os.path.dirname(self.snapname), exist_ok = True)
+        tmpname = self.snapname + '.tmp'
+        with open(tmpname, 'wb') as fp:
+            fp.write(b''.join(entries + strings))
+        os.replace(tmpname, self.snapname)
+
+        with open(self.filename, 'wb') as fp:
+            fp.write(self.MAGIC)
+
+        self.buffer  = b''
+        self.index   = {}
+        self.size    = len(self.MAGIC)
+        self.records = 0
+        self.dirty.clear()
+        self.touched.clear()
+        self._load_snapshot()
+
+    def _evict(self, values):
+        """
+        Remove expired and least recently used entries from `values`
+        """
+        removed = []
+
+        if Cache.max_age > 0:
+            expire  = self.now - Cache.max_age * 24 * 60 * 60
+            removed = [ key for key in values if values[key][1] < expire ]
+
+        for key in removed:
+            del values[key]
+
+        # Shrink to three quarters of the limit, to avoid compacting on every flush
+        limit = self._limit()
+        total = self.HEADER.size + sum([ self.ENTRY.size + len(key) + len(values[key][0])
+                                         for key in values ])
+
+        if limit and total > limit:
+            for key in sorted(values, key = lambda k: values[k][1]):
+                if total <= limit * 3 // 4:
+                    break
+                total -= self.ENTRY.size + len(key) + len(values[key][0])
+                del values[key]
+                removed.append(key)
+
+        for key in removed:
+            self.data.pop(key.decode('utf-8'), None)
+
+        self.evictions += len(removed)
+        if removed:
+            self.log.debug('Cache ' + self.name + ' : evicted ' + str(len(removed)) + ' entries')
+
+class DigestIndex(Singleton):
+    """
+    Persistent index of file content digests
+
+    The digest of a file is only computed again if its
+    modification time, size or inode changed.
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.cache = Cache.Instance('digests')
+
+    def digest(self, path):
+        """
+        Retrieve the content digest of the file at `path`
+
+        Returns `None` if the file does not exist.
+        """
+        st = StatCache.Instance().stat(path)
+        if st is None:
+            return None
+
+        key   = (st.st_mtime, st.st_size, st.st_ino)
+        entry = self.cache.get(path)
+
+        if entry is not None and entry[0] == key:
+            return entry[1]
+
+        # Compute the digest of the file contents
+        md5 = hashlib.md5()
+        try:
+            with open(path, 'rb') as fp:
+                for block in iter(lambda: fp.read(65536), b''):
+                    md5.update(block)
+        except IOError:
+            return None
+
+        self.cache.put(path, (key, md5.hexdigest()))
+        return md5.hexdigest()
+
+class CodeCache(Singleton):
+    """
+    Persistent cache of compiled Python code
+
+    Like CPython does for .pyc files, code is only compiled again if the
+    modification time or size of the file or the Python version changed.
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.cache = Cache.Instance('bytecode')
+        self.code  = {}
+
+    def compile(self, filename):
+        """
+        Retrieve the code object of the Python file `filename`
+        """
+        filename = os.path.abspath(filename)
+
+        try:
+            return self.code[filename]
+        except KeyError:
+            pass
+
+        st = StatCache.Instance().stat(filename)
+        key = (st.st_mtime, st.st_size, importlib.util.MAGIC_NUMBER) if st else None
+        entry = self.cache.get(filename)
+
+        if entry is not None and key is not None and entry[0] == key:
+            code = marshal.loads(entry[1])
+        else:
+            with open(filename) as fp:
+                code = compile(fp.read(), filename, 'exec')
+            self.cache.put(filename, (key, marshal.dumps(code)))
+
+        self.code[filename] = code
+        return code
+
+class ProjectWalker(Singleton):
+    """
+    Finds Bouwfiles and Bouwconfigs in a directory tree
+
+    Each directory is listed only once with :func:`os.scandir`. Listings
+    are remembered in the 'layout' cache and only read again if the
+    modification time of the directory changed.
+    """
+
+    """ Files of interest end with one of these """
+    SUFFIXES = ('Bouwfile', 'Bouwconfig')
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.cache    = Cache.Instance('layout')
+        self.listings = {}
+
+    def listing(self, dirname):
+        """
+        Return the files of interest and the subdirectories of `dirname`
+        """
+        path = os.path.abspath(dirname)
+
+        try:
+            return self.listings[path]
+        except KeyError:
+            pass
+
+        st = StatCache.Instance().stat(path)
+        mtime = st.st_mtime if st is not None else None
+        entry = self.cache.get(path)
+
+        if entry is not None and entry[0] == mtime:
+            listing = entry[1]
+        else:
+            files, dirs = [], []
+
+            for item in os.scandir(path):
+                if item.name.endswith(self.SUFFIXES):
+                    files.append(item.name)
+                elif item.is_dir():
+                    dirs.append(item.name)
+
+            listing = (files, dirs)
+            self.cache.put(path, (mtime, listing))
+
+        self.listings[path] = listing
+        return listing
+
+    def walk(self, dirname, suffix):
+        """
+        Find all files ending with `suffix` in and below `dirname`
+
+        Subdirectories are only searched if their parent
+        directory contains at least one such file.
+        """
+        files, dirs = self.listing(dirname)
+        found = [ dirname + os.sep + name for name in files if name.endswith(suffix) ]
 
-    def timestamp(self):
-        return self.stat.st_mtime
+        if found:
+            for name in dirs:
+                found += self.walk(dirname + os.sep + name, suffix)
 
+        return found
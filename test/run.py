@@ -49,14 +49,16 @@ if srcdir not in sys.path:
 if plugdir not in sys.path:
     sys.path.insert(2, plugdir)
 
-# Retrieve tests to be executed
-if len(sys.argv) > 1:
-    suite = unittest.TestLoader().loadTestsFromName(sys.argv[1])
-else:
-    suite  = unittest.TestLoader().discover('.', 'test_*.py')
-
-# Startup the unit tests
-runner = unittest.TextTestRunner(verbosity=2)
-runner.resultclass = MyTestResult
-runner.run(suite)
+if __name__ == '__main__':
+
+    # Retrieve tests to be executed
+    if len(sys.argv) > 1:
+        suite = unittest.TestLoader().loadTestsFromName(sys.argv[1])
+    else:
+        suite  = unittest.TestLoader().discover('.', 'test_*.py')
+
+    # Startup the unit tests
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.resultclass = MyTestResult
+    runner.run(suite)
 
@@ -46,6 +46,9 @@ class BouwerTester(unittest.TestCase):
         if self.srcdir not in sys.path:
             sys.path.insert(1, self.srcdir)
 
+        # The finder for '.' must follow the current working directory
+        sys.path_importer_cache.pop('.', None)
+
 class ConfTester(BouwerTester):
     """
     Tester class for the configuration layer
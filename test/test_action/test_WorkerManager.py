@@ -0,0 +1,432 @@
+#
+# Copyright (C) 2012 Niek Linnenbank
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Bouwer action scheduling tests
+"""
+
+import shutil
+import multiprocessing
+import threading
+import tempfile
+from test import *
+from bouwer.action import *
+import bouwer.util
+
+class DummyBuilder:
+    """
+    Records the :class:`.ActionEvent` objects of finished actions
+    """
+
+    def __init__(self):
+        """ Constructor """
+        self.finished = []
+        self.results  = []
+
+    def action_event(self, action, event):
+        """ Called for each :class:`.ActionEvent` """
+        if event.type == ActionEvent.FINISH:
+            self.finished.append(action.target)
+            self.results.append(event.result)
+
+    def action_run(self, action):
+        """ Create the target of `action` """
+        open(action.target, 'w').close()
+        return 0
+
+class WorkerManagerTester(BouwerTester):
+    """
+    Tester class for the :class:`.WorkerManager`
+    """
+
+    def setUp(self):
+        """ Runs before each test """
+        super(WorkerManagerTester, self).setUp()
+        sys.argv = [ "bouw", "--workers", "2" ]
+        CommandLine.Destroy()
+        self.cli = CommandLine.Instance()
+        self.builder = DummyBuilder()
+        self.tmpdir = tempfile.mkdtemp()
+        self.actions = {}
+        self.cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+
+    def tearDown(self):
+        """ Runs after each test """
+        os.chdir(self.cwd)
+        for executor in EXECUTORS.values():
+            executor.Instance().shutdown()
+            executor.Destroy()
+        JobServer.Instance().shutdown()
+        JobServer.Destroy()
+        Throttle.Destroy()
+        CommandLine.Destroy()
+        shutil.rmtree(self.tmpdir, True)
+
+    def _path(self, name):
+        """ Return the path to `name` in the temporary directory """
+        return self.tmpdir + os.sep + name
+
+    def _action(self, name, sources):
+        """ Add an action which creates the file `name` """
+        target = self._path(name)
+        self.actions[target] = Action(target, [ self._path(s) for s in sources ],
+                                      'touch ' + target, {}, self.builder)
+
+    def test_order(self):
+        """ Dependencies must finish before their dependents """
+        self._action('a', [])
+        self._action('b', ['a'])
+        self._action('c', ['a'])
+        self._action('d', ['b', 'c', 'a'])
+
+        WorkerManager(self.actions).execute()
+
+        order = self.builder.finished
+        self.assertEqual(len(order), 4)
+        self.assertEqual(order[0], self._path('a'))
+        self.assertEqual(order[3], self._path('d'))
+
+    def test_uptodate(self):
+        """ Actions with an up-to-date target must not run """
+        self._action('a', [])
+        self._action('b', ['a'])
+        WorkerManager(self.actions).execute()
+
+        for action in self.actions.values():
+            action.status = ActionEvent.CREATE
+
+        self.builder.finished = []
+        WorkerManager(self.actions).execute()
+        self.assertEqual(self.builder.finished, [])
+
+    def test_circular(self):
+        """ Circular dependencies must be detected """
+        self._action('a', ['b'])
+        self._action('b', ['a'])
+        self.assertRaises(Exception, WorkerManager(self.actions).execute)
+
+    def test_critical_path(self):
+        """ The longest chain of actions must start first """
+        self.cli.args.workers = 1
+        self._action('x', [])
+        self._action('a', [])
+        self._action('b', ['a'])
+        self._action('c', ['b'])
+
+        WorkerManager(self.actions).execute()
+        self.assertEqual(self.builder.finished[0], self._path('a'))
+
+    def test_fifo(self):
+        """ Ready actions must run in order with the fifo schedule """
+        self.cli.args.workers = 1
+        self.cli.args.schedule = 'fifo'
+        self._action('x', [])
+        self._action('a', [])
+        self._action('b', ['a'])
+
+        WorkerManager(self.actions).execute()
+        self.assertEqual(self.builder.finished, [ self._path('x'),
+                                                  self._path('a'),
+                                                  self._path('b') ])
+
+    def test_history(self):
+        """ Executed actions must provide an estimate for the next run """
+        self._action('a', [])
+        WorkerManager(self.actions).execute()
+
+        action = self.actions[self._path('a')]
+        self.assertIsNotNone(ActionHistory().estimate(action))
+
+        action.status = ActionEvent.CREATE
+        done, eta = WorkerManager(self.actions).progress()
+        self.assertEqual(done, 0.0)
+        self.assertIsNotNone(eta)
+
+        # A different command has no history yet
+        action.command += ' ' + self._path('b')
+        self.assertIsNone(ActionHistory().estimate(action))
+
+    def test_signature(self):
+        """ Actions must run again if their command changes """
+        self._action('a', [])
+        self._action('b', ['a'])
+        WorkerManager(self.actions).execute()
+
+        for action in self.actions.values():
+            action.status = ActionEvent.CREATE
+
+        self.actions[self._path('b')].command += ' ' + self._path('c')
+        self.builder.finished = []
+        WorkerManager(self.actions).execute()
+        self.assertEqual(self.builder.finished, [ self._path('b') ])
+
+    def test_rebuild_check_hash(self):
+        """ Touched sources with the same content must not trigger a build """
+        self.cli.args.rebuild_check = 'mtime+hash'
+        source = self._path('src')
+        open(source, 'w').write('one')
+        self._action('a', ['src'])
+        WorkerManager(self.actions).execute()
+
+        # Touch the source without changing its content
+        st = os.stat(source)
+        os.utime(source, (st.st_atime + 10, st.st_mtime + 10))
+        bouwer.util.StatCache.Instance().invalidate(source)
+        self.actions[self._path('a')].status = ActionEvent.CREATE
+        self.builder.finished = []
+        WorkerManager(self.actions).execute()
+        self.assertEqual(self.builder.finished, [])
+
+        # Change the content of the source
+        open(source, 'w').write('two')
+        os.utime(source, (st.st_atime + 20, st.st_mtime + 20))
+        bouwer.util.StatCache.Instance().invalidate(source)
+        self.actions[self._path('a')].status = ActionEvent.CREATE
+        WorkerManager(self.actions).execute()
+        self.assertEqual(self.builder.finished, [ self._path('a') ])
+
+    def test_record(self):
+        """ Workers must only receive a compact record of the action """
+        self._action('a', [])
+        action = self.actions[self._path('a')]
+        action.tags['quiet'] = True
+        action.tags['builder'] = self.builder
+
+        record = action.record()
+        self.assertEqual(record, (action.target, action.command, { 'quiet' : True }))
+        self.assertEqual(Action.restore(record).command, action.command)
+
+        # Python functions run in the main process
+        self.actions[self._path('b')] = Action(self._path('b'), [ self._path('a') ],
+                                               lambda action: 0, {}, self.builder)
+        self.assertIsNone(self.actions[self._path('b')].record())
+
+        WorkerManager(self.actions).execute()
+        self.assertEqual(self.builder.finished, [ self._path('a'), self._path('b') ])
+
+    def test_pool(self):
+        """ Workers must be reused by each run """
+        self._action('a', [])
+        WorkerManager(self.actions).execute()
+        workers = list(WorkerPool.Instance().workers)
+        self.assertTrue(len(workers) >= 2)
+
+        self.actions = {}
+        self._action('b', [])
+        WorkerManager(self.actions).execute()
+        self.assertEqual(WorkerPool.Instance().workers, workers)
+        self.assertTrue(all([ proc.is_alive() for proc in workers ]))
+
+    def test_dead_worker(self):
+        """ A worker which exits must fail the build """
+        self.cli.args.workers = 1
+        pool = WorkerPool.Instance()
+        pool.start(1)
+        pool.workers[0].terminate()
+        pool.workers[0].join()
+
+        self._action('a', [])
+        self.assertRaises(Exception, WorkerManager(self.actions).execute)
+
+    def test_spawn(self):
+        """ Methods must run in the manager with spawned workers """
+        multiprocessing.set_start_method('spawn', force=True)
+        try:
+            self._action('a', [])
+            target = self._path('b')
+            self.actions[target] = Action(target, [ self._path('a') ],
+                                          self.builder.action_run, {}, self.builder)
+            self.assertIsNone(self.actions[target].record())
+
+            WorkerManager(self.actions).execute()
+            self.assertEqual(self.builder.finished, [ self._path('a'), target ])
+        finally:
+            WorkerPool.Instance().shutdown()
+            WorkerPool.Destroy()
+            multiprocessing.set_start_method('fork', force=True)
+
+    def test_failed(self):
+        """ Failed actions must be reported """
+        self._action('a', [])
+        self.actions[self._path('a')].command = 'false'
+        workers = WorkerManager(self.actions)
+        workers.execute()
+        self.assertEqual(workers.failed, [ self._path('a') ])
+
+    def test_async(self):
+        """ Actions must run in order on the asyncio executor """
+        self.cli.args.executor = 'async'
+        called = []
+        self._action('a', [])
+        self._action('b', ['a'])
+        self.actions[self._path('c')] = Action(self._path('c'), [ self._path('b') ],
+                                               lambda action: called.append(action.target) or 0,
+                                               {}, self.builder)
+        WorkerManager(self.actions).execute()
+
+        self.assertEqual(self.builder.finished, [ self._path('a'),
+                                                  self._path('b'),
+                                                  self._path('c') ])
+        self.assertEqual(called, [ self._path('c') ])
+        self.assertTrue(os.path.exists(self._path('b')))
+        self.assertEqual(WorkerPool.Instance().workers, [])
+
+    def test_threads(self):
+        """ Python functions must run on threads of the main process """
+        threads = []
+        for name in [ 'a', 'b' ]:
+            target = self._path(name)
+            self.actions[target] = Action(target, [], lambda action:
+                                          threads.append(threading.current_thread()) or 0,
+                                          {}, self.builder)
+        WorkerManager(self.actions).execute()
+
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.main_thread(), threads)
+        self.assertEqual(WorkerPool.Instance().workers, [])
+
+    def test_argv(self):
+        """ Lists of arguments must be executed without a shell """
+        self._action('a', [])
+        action = self.actions[self._path('a')]
+        action.command = [ 'touch', self._path('a b') ]
+        self.assertEqual(action.command_line(), "touch '" + self._path('a b') + "'")
+
+        WorkerManager(self.actions).execute()
+        self.assertTrue(os.path.exists(self._path('a b')))
+
+    def test_argv_missing(self):
+        """ Missing programs must fail like they do in a shell """
+        for executor in [ 'process', 'async' ]:
+            self.cli.args.executor = executor
+            self._action('a', [])
+            action = self.actions[self._path('a')]
+            action.command = [ self._path('missing') ]
+            action.tags['quiet'] = True
+
+            workers = WorkerManager(self.actions)
+            workers.execute()
+            self.assertEqual(workers.failed, [ self._path('a') ], executor)
+            self.assertEqual(self.builder.results[-1], 127, executor)
+
+    def test_jobserver_client(self):
+        """ Actions next to the first must take a slot of the jobserver """
+        reader, writer = os.pipe()
+        os.write(writer, b'+')
+        os.environ['MAKEFLAGS'] = '-j2 --jobserver-auth=' + str(reader) + ',' + str(writer)
+
+        try:
+            jobs = JobServer.Instance()
+            self.assertTrue(jobs.acquire(0))
+            self.assertTrue(jobs.acquire(1))
+            self.assertFalse(jobs.acquire(2))
+            jobs.release(1)
+            self.assertEqual(jobs.tokens, [])
+
+            self._action('a', [])
+            self._action('b', [])
+            self._action('c', [])
+            WorkerManager(self.actions).execute()
+            self.assertEqual(len(self.builder.finished), 3)
+            self.assertEqual(os.read(reader, 2), b'+')
+        finally:
+            JobServer.Instance().shutdown()
+            del os.environ['MAKEFLAGS']
+            os.close(reader)
+            os.close(writer)
+
+    def test_jobserver_uptodate(self):
+        """ Up-to-date actions must not wait for a slot of the jobserver """
+        reader, writer = os.pipe()
+        os.environ['MAKEFLAGS'] = '-j2 --jobserver-auth=' + str(reader) + ',' + str(writer)
+
+        try:
+            self.cli.args.schedule = 'fifo'
+            self._action('x', [])
+            self._action('y', [])
+            WorkerManager(self.actions).execute()
+
+            # The jobserver has no free slot while 'a' runs
+            self.actions = {}
+            self._action('a', [])
+            self._action('x', [])
+            self._action('y', [])
+            seen = []
+            self.builder.action_event = lambda action, event: seen.append(
+                [ self.actions[self._path(name)].status for name in [ 'x', 'y' ] ])
+
+            WorkerManager(self.actions).execute()
+            self.assertEqual(seen[-1], [ ActionEvent.FINISH, ActionEvent.FINISH ])
+        finally:
+            JobServer.Instance().shutdown()
+            del os.environ['MAKEFLAGS']
+            os.close(reader)
+            os.close(writer)
+
+    def test_jobserver_server(self):
+        """ Commands must be able to use the slots of the jobserver """
+        os.environ.pop('MAKEFLAGS', None)
+        jobs = JobServer.Instance()
+        self.assertIn('--jobserver-auth=', os.environ['MAKEFLAGS'])
+
+        # A nested build takes and returns the only free slot
+        target = self._path('a')
+        self.actions[target] = Action(target, [], 'head -c 1 <&' + str(jobs.opened[0]) +
+                                      ' >&' + str(jobs.opened[1]) + ' && touch ' + target,
+                                      {}, self.builder)
+        WorkerManager(self.actions).execute()
+        self.assertTrue(os.path.exists(target))
+
+        jobs.shutdown()
+        self.assertNotIn('MAKEFLAGS', os.environ)
+
+    def test_throttle(self):
+        """ Only one action may run while the system is overloaded """
+        self.cli.args.min_free_memory = sys.maxsize // 1024
+        self._action('a', [])
+        self._action('b', [])
+        self._action('c', [])
+
+        throttle = Throttle.Instance()
+        if throttle.available() is None:
+            self.skipTest('available memory is unknown')
+
+        WorkerManager(self.actions).execute()
+        self.assertEqual(len(self.builder.finished), 3)
+        self.assertGreater(throttle.count, 0)
+
+    def test_throttle_uptodate(self):
+        """ Up-to-date actions must not be held back """
+        self.cli.args.schedule = 'fifo'
+        self._action('x', [])
+        self._action('y', [])
+        WorkerManager(self.actions).execute()
+
+        throttle = Throttle.Instance()
+        throttle.min_free = sys.maxsize // 1024
+        if throttle.available() is None:
+            self.skipTest('available memory is unknown')
+
+        self.actions = {}
+        self._action('a', [])
+        self._action('x', [])
+        self._action('y', [])
+        self.builder.finished = []
+        WorkerManager(self.actions).execute()
+        self.assertEqual(self.builder.finished, [ self._path('a') ])
+        self.assertEqual(throttle.count, 0)
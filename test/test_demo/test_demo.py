@@ -22,12 +22,14 @@ import inspect
 import unittest
 import logging
 import subprocess
+import tarfile
 
 import bouwer.cli
 import bouwer.plugin
 import bouwer.config
 import bouwer.builder
 import bouwer.action
+import bouwer.util
 
 from CCompiler import CCompiler
 from test import *
@@ -64,6 +66,10 @@ class DemoClass(BouwerTester):
         bouwer.builder.BuilderManager.Destroy()
         bouwer.plugin.PluginManager.Destroy()
         bouwer.cli.CommandLine.Destroy()
+        bouwer.util.StatCache.Destroy()
+        bouwer.util.ProjectWalker.Destroy()
+        bouwer.action.WorkerPool.Instance().shutdown()
+        bouwer.action.WorkerPool.Destroy()
         CCompiler.Destroy()
 
         # Create command line interface object
@@ -144,6 +150,36 @@ class HelloTester(DemoClass):
         """ Verify compilation of Hello World """
         self.assertEqual(self._run_prog('hello'), "Hello World!\n")
 
+    def test_hello_ninja(self):
+        """ Verify export of Hello World to a Ninja file """
+        self.conf.args.emit_ninja = bouwer.util.tempfile('build.ninja')
+        self.build.execute('build', self.conf.trees.get('DEFAULT'))
+        self.conf.args.emit_ninja = None
+
+        ninja = open(bouwer.util.tempfile('build.ninja')).read()
+        self.assertIn('build hello.o: depfile hello.c\n', ninja)
+        self.assertIn('  depfile = .bouwtemp/deps/hello.d\n', ninja)
+        self.assertIn('build hello: command hello.o\n', ninja)
+        self.assertNotIn('config.h:', ninja)
+
+    def test_hello_graph(self):
+        """ Verify writing outputs keeps the saved actions of Hello World """
+        digest = self.build.graph.fingerprint()
+        open('hello.out', 'w').close()
+
+        try:
+            bouwer.util.StatCache.Destroy()
+            bouwer.util.ProjectWalker.Destroy()
+            self.build.graph.digest = None
+            self.assertEqual(self.build.graph.fingerprint(), digest)
+
+            # Only a successful build is saved
+            self.build.graph.cache.put('DEFAULT:build', None)
+            self.build.execute('build', self.conf.trees.get('DEFAULT'))
+            self.assertIsNotNone(self.build.graph.load('build', self.conf.trees.get('DEFAULT')))
+        finally:
+            os.remove('hello.out')
+
 @demo('c/library')
 class LibraryTester(DemoClass):
     """ Tests for the Library builder demo """
@@ -165,6 +201,58 @@ class LibraryTester(DemoClass):
         self.assertEqual(self._run_prog('myprog' + os.sep + 'myprog'),
                         'libdummy bar feature activated\nint=0 fuzz=1\n')
 
+    def test_library_parse(self):
+        """ Verify the Bouwfiles of the Library demo are parsed once """
+        bouwfiles = self.build.parser.bouwfiles['.']
+        self.assertEqual(len(bouwfiles), 6)
+
+        targets = dict(bouwfiles)
+        self.assertEqual(sorted(targets['./Bouwfile']), [ 'dist' ])
+        self.assertEqual(sorted(targets['./libdummy/Bouwfile']), [ 'build' ])
+
+    def test_library_graph(self):
+        """ Verify the actions of the Library demo are saved """
+        tree   = self.conf.trees.get('DEFAULT')
+        rounds = self.build.graph.load('build', tree)
+        self.assertIsNotNone(rounds)
+
+        targets = [ action[0] for actions in rounds for action in actions ]
+        self.assertIn('myprog/myprog', targets)
+        self.assertIn('libdummy/libdummy.a', targets)
+
+        # Objects list the headers from their depfile
+        objects = dict([ (action[0], action) for actions in rounds for action in actions ])
+        target, sources, command, tags, builder = objects['myprog/main.o']
+        self.assertIn('libdummy/libdummy.h', sources)
+        self.assertEqual(tags['implicit'], sources[:-1])
+
+    def test_library_dist(self):
+        """ Verify the archive of the Library demo only holds sources """
+        try:
+            self.build.execute('dist', self.conf.trees.get('DEFAULT'))
+            names = tarfile.open('library.tar.gz').getnames()
+            self.assertIn('library/myprog/main.c', names)
+            self.assertEqual([ name for name in names if name.endswith(('.o', '.d')) ], [])
+        finally:
+            os.remove('library.tar.gz')
+
+    def test_library_glob(self):
+        """ Verify new files reject the saved actions of the Library demo """
+        tree = self.conf.trees.get('DEFAULT')
+
+        try:
+            # The second run sees the archive written by the first
+            self.build.execute('dist', tree)
+            self.build.execute('dist', tree)
+            self.assertIsNotNone(self.build.graph.load('dist', tree))
+
+            open('NEWFILE', 'w').close()
+            self.assertIsNone(self.build.graph.load('dist', tree))
+        finally:
+            for name in [ 'NEWFILE', 'library.tar.gz' ]:
+                if os.path.exists(name):
+                    os.remove(name)
+
 @demo('c/override')
 class OverrideTester(DemoClass):
     """ Tests for the Config override demo """
@@ -0,0 +1,162 @@
+#
+# Copyright (C) 2012 Niek Linnenbank
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Bouwer C compiler header dependency tests
+"""
+
+import shutil
+import tempfile
+from test import *
+import bouwer.plugin
+import bouwer.builder
+import bouwer.action
+import bouwer.util
+from bouwer.builder import SourcePath, TargetPath
+from CCompiler import CCompiler
+
+class DummyInstance:
+    """
+    Stands in for the active :class:`.BuilderInstance`
+    """
+    builder = 'CCompiler'
+
+class CCompilerTester(BouwerTester):
+    """
+    Tester class for the header dependencies of the :class:`.CCompiler`
+    """
+
+    def setUp(self):
+        """ Runs before each test """
+        super(CCompilerTester, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+
+        sys.argv = [ "bouw" ]
+        bouwer.cli.CommandLine.Destroy()
+        Configuration.Destroy()
+        bouwer.builder.BuilderManager.Destroy()
+        bouwer.util.StatCache.Destroy()
+        CCompiler.Destroy()
+
+        self.cli   = bouwer.cli.CommandLine.Instance()
+        self.conf  = Configuration.Instance(self.cli)
+        self.build = bouwer.builder.BuilderManager.Instance()
+        self.conf.args = self.cli.parse()
+        self.conf.active_tree = self.conf.trees.get('DEFAULT')
+        self.conf.active_dir  = '.'
+        self.build.actions = bouwer.action.ActionManager()
+        self.build.parser.mesh.active_instance = DummyInstance()
+        self.cc = CCompiler.Instance()
+
+        self._write('main.c', '#include "a.h"\nint main(void) { return 0; }\n')
+        self._write('a.h', '#include "b.h"\n')
+        self._write('b.h', '')
+        self._write('main.o', '')
+
+        self.source  = SourcePath('main.c')
+        self.outfile = TargetPath('main.o')
+        bouwer.util.Cache.Instance('c_headers').put(self.source.absolute, None)
+
+    def tearDown(self):
+        """ Runs after each test """
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir, True)
+        CCompiler.Destroy()
+        bouwer.builder.BuilderManager.Destroy()
+        bouwer.util.StatCache.Destroy()
+        Configuration.Destroy()
+        bouwer.cli.CommandLine.Destroy()
+
+    def _write(self, name, text):
+        """ Create the file `name` with the given content """
+        open(name, 'w').write(text)
+
+    def _touch(self, name, delta):
+        """ Move the modification time of `name` forward by `delta` seconds """
+        st = os.stat(name)
+        os.utime(name, (st.st_atime + delta, st.st_mtime + delta))
+        bouwer.util.StatCache.Instance().invalidate(name)
+
+    def test_depfile(self):
+        """ Headers must be read from the depfile of the compiler """
+        self._write('main.d', 'main.o: main.c a.h \\\n  b.h\nb.h:\n')
+        self.assertEqual(self.cc._find_headers(self.source, self.outfile, 'main.d'),
+                         [ 'a.h', 'b.h' ])
+
+    def test_missing_object(self):
+        """ No headers are needed if the object must be compiled anyway """
+        os.remove('main.o')
+        self.assertEqual(self.cc._find_headers(self.source, self.outfile, 'main.d'), [])
+
+    def test_missing_depfile(self):
+        """ The C file must be scanned without depfile or earlier scan """
+        self.assertIsNone(self.cc._find_headers(self.source, self.outfile, 'main.d'))
+
+    def test_cached(self):
+        """ Headers of an earlier scan must be used until a file changes """
+        self.cc._remember_headers(self.source, [ 'a.h', 'b.h' ])
+        self.assertEqual(self.cc._find_headers(self.source, self.outfile), [ 'a.h', 'b.h' ])
+
+        # Changing a header rejects the entry
+        self._touch('b.h', 10)
+        self.assertIsNone(self.cc._find_headers(self.source, self.outfile))
+
+        # Changing the size of the C file rejects the entry
+        self.cc._remember_headers(self.source, [ 'a.h', 'b.h' ])
+        self._write('main.c', '#include "a.h"\n')
+        bouwer.util.StatCache.Instance().invalidate('main.c')
+        self.assertIsNone(self.cc._find_headers(self.source, self.outfile))
+
+        # Changing the modification time of the C file rejects the entry
+        self.cc._remember_headers(self.source, [ 'a.h', 'b.h' ])
+        self._touch('main.c', 10)
+        self.assertIsNone(self.cc._find_headers(self.source, self.outfile))
+
+    def test_deferred(self):
+        """ Scanned C files must be registered when the round runs """
+        self.cc.c_object(self.source)
+        self.assertEqual(self.build.actions.actions, {})
+        self.assertIsNotNone(self.cc.scanner)
+
+        # The active builder and directory are restored
+        instance = self.build.parser.mesh.active_instance
+        restored = []
+        self.build.defer(lambda: restored.append((self.build.parser.mesh.active_instance,
+                                                  self.conf.active_dir)))
+        self.build.parser.mesh.active_instance = None
+        self.conf.active_dir = './other'
+        self.build.run_deferred()
+
+        self.assertEqual(restored, [ (instance, '.') ])
+        action = self.build.actions.actions['main.o']
+        self.assertEqual(action.sources, [ 'a.h', 'b.h', 'main.c' ])
+        self.assertEqual(action.builder, 'CCompiler')
+        self.assertEqual(self.cc._find_headers(self.source, self.outfile), [ 'a.h', 'b.h' ])
+
+    def test_command(self):
+        """ Commands must be executed without a shell if possible """
+        self.assertEqual(self.cc._command('gcc -o', 'main.o', '-DMSG="Hello World"'),
+                         [ 'gcc', '-o', 'main.o', '-DMSG=Hello World' ])
+        self.assertEqual(self.cc._command('gcc -o', 'main.o', '`pkg-config --cflags x`'),
+                         'gcc -o main.o `pkg-config --cflags x`')
+
+        os.mkdir(bouwer.util.tempfile('deps'))
+        self._write(bouwer.util.tempfile('deps' + os.sep + 'main.d'), 'main.o: main.c\n')
+        self.cc.c_object(self.source)
+        self.assertIsInstance(self.build.actions.actions['main.o'].command, list)
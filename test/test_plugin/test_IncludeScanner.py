@@ -0,0 +1,86 @@
+#
+# Copyright (C) 2012 Niek Linnenbank
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Bouwer C include scanner tests
+"""
+
+import shutil
+import tempfile
+from test import *
+import bouwer.util
+from CCompiler import IncludeScanner
+
+class IncludeScannerTester(BouwerTester):
+    """
+    Tester class for the :class:`.IncludeScanner`
+    """
+
+    def setUp(self):
+        """ Runs before each test """
+        super(IncludeScannerTester, self).setUp()
+        bouwer.util.StatCache.Destroy()
+        self.tmpdir = tempfile.mkdtemp()
+        os.mkdir(self._path('include'))
+
+    def tearDown(self):
+        """ Runs after each test """
+        shutil.rmtree(self.tmpdir, True)
+
+    def _path(self, name):
+        """ Return the path to `name` in the temporary directory """
+        return os.path.normpath(self.tmpdir + os.sep + name)
+
+    def _write(self, name, text):
+        """ Create the file `name` with the given content """
+        open(self._path(name), 'w').write(text)
+
+    def test_scan(self):
+        """ Headers must be found transitively, skipping system headers """
+        self._write('main.c', '#include <stdio.h>\n#include "a.h"\n'
+                              '#ifdef FOO\n  #  include <b.h>\n#endif\n')
+        self._write('a.h', '#include "c.h"\n')
+        self._write('c.h', '#include "a.h"\n#include <c.h>\n')
+        self._write('include/b.h', '#include "d.h"\n')
+        self._write('include/c.h', '')
+        self._write('include/d.h', '')
+
+        scanner = IncludeScanner()
+        headers = scanner.scan(self._path('main.c'), [ self._path('include') ])
+        self.assertEqual(headers, sorted([ self._path('a.h'),
+                                           self._path('c.h'),
+                                           self._path('include/b.h'),
+                                           self._path('include/c.h'),
+                                           self._path('include/d.h') ]))
+
+        # Headers including each other share their headers
+        incpath = (self._path('include'),)
+        self.assertEqual(scanner.transitive[(self._path('a.h'), incpath)],
+                         set([ self._path('a.h'), self._path('c.h'), self._path('include/c.h') ]))
+        self.assertIs(scanner.transitive[(self._path('a.h'), incpath)],
+                      scanner.transitive[(self._path('c.h'), incpath)])
+        self.assertEqual(scanner.transitive[(self._path('include/b.h'), incpath)],
+                         set([ self._path('include/d.h') ]))
+
+        # Shared headers must be parsed only once
+        self._write('other.c', '#include "a.h"\n')
+        transitive = len(scanner.transitive)
+        headers = scanner.scan(self._path('other.c'), [ self._path('include') ])
+        self.assertEqual(len(scanner.direct), 7)
+        self.assertEqual(len(scanner.transitive), transitive)
+        self.assertEqual(headers, sorted([ self._path('a.h'), self._path('c.h'),
+                                           self._path('include/c.h') ]))
@@ -0,0 +1,163 @@
+#
+# Copyright (C) 2012 Niek Linnenbank
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import shutil
+import tempfile
+import bouwer.util
+from test import *
+
+class CacheTester(BouwerTester):
+    """ Tests for the persistent :class:`.Cache` """
+
+    def setUp(self):
+        """ Runs before each testcase """
+        super(CacheTester, self).setUp()
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        os.chdir(self.tmpdir)
+
+    def tearDown(self):
+        """ Runs after each testcase """
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir, True)
+        bouwer.util.Cache.Configure(0, 0)
+
+    def test_persist(self):
+        """ Verify that entries survive a flush """
+        cache = bouwer.util.Cache('dummy')
+        cache.put('a', [1, 2])
+        cache.put('b', 'two')
+        cache.flush()
+
+        cache.put('a', [3])
+        cache.flush()
+
+        cache = bouwer.util.Cache('dummy')
+        self.assertEqual(cache.get('a'), [3])
+        self.assertEqual(cache.get('b'), 'two')
+        self.assertEqual(cache.get('c'), None)
+
+    def test_compact(self):
+        """ Verify that the log does not grow with repeated updates """
+        cache = bouwer.util.Cache('dummy')
+        cache.COMPACT = 4
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.flush()
+
+        for i in range(10):
+            cache.put('a', i)
+            cache.flush()
+            self.assertLessEqual(cache.records, 4)
+
+        self.assertTrue(os.path.exists(cache.snapname))
+        self.assertEqual(bouwer.util.Cache('dummy').get('a'), 9)
+        self.assertEqual(bouwer.util.Cache('dummy').get('b'), 2)
+
+    def test_snapshot(self):
+        """ Verify that entries are found in the snapshot """
+        cache = bouwer.util.Cache('dummy')
+        for i in range(100):
+            cache.put('key' + str(i), i)
+        cache.compact()
+
+        cache = bouwer.util.Cache('dummy')
+        self.assertEqual(cache.count, 100)
+        self.assertEqual(cache.records, 0)
+
+        for i in range(100):
+            self.assertEqual(cache.get('key' + str(i)), i)
+        self.assertEqual(cache.get('key'), None)
+        self.assertEqual(cache.get('zzz'), None)
+
+        # Changes since the snapshot are read from the log
+        cache.put('key5', 'five')
+        cache.flush()
+        self.assertEqual(bouwer.util.Cache('dummy').get('key5'), 'five')
+
+    def test_interrupted(self):
+        """ Verify that an incomplete record is ignored """
+        cache = bouwer.util.Cache('dummy')
+        cache.put('a', 1)
+        cache.flush()
+
+        with open(cache.filename, 'ab') as fp:
+            fp.write(b'\x05\x00\x00')
+
+        cache = bouwer.util.Cache('dummy')
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('b', 2)
+        cache.flush()
+
+        cache = bouwer.util.Cache('dummy')
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('b'), 2)
+
+    def test_evict_age(self):
+        """ Verify that entries unused for too long are removed """
+        cache = bouwer.util.Cache('dummy')
+        cache.now -= 10 * 24 * 60 * 60
+        cache.put('old', 1)
+        cache.compact()
+
+        bouwer.util.Cache.Configure(0, 5)
+        cache = bouwer.util.Cache('dummy')
+        cache.put('new', 2)
+        cache.flush()
+        self.assertEqual(cache.evictions, 1)
+
+        cache = bouwer.util.Cache('dummy')
+        self.assertEqual(cache.get('old'), None)
+        self.assertEqual(cache.get('new'), 2)
+
+    def test_evict_size(self):
+        """ Verify that the least recently used entries are removed """
+        cache = bouwer.util.Cache('dummy')
+        for i in range(100):
+            cache.now += 1
+            cache.put('key' + str(i), 'x' * 100)
+            cache.flush()
+        cache.compact()
+        size = cache.bytes()
+        del cache
+
+        bouwer.util.Cache.Configure(0, 0, { 'dummy' : size // 2 })
+        cache = bouwer.util.Cache('dummy')
+        cache.flush()
+        self.assertLessEqual(cache.bytes(), size // 2)
+        self.assertGreater(cache.evictions, 50)
+        self.assertEqual(cache.get('key0'), None)
+        self.assertEqual(cache.get('key99'), 'x' * 100)
+
+    def test_shared(self):
+        """ Verify that processes sharing the cache files keep each others entries """
+        first  = bouwer.util.Cache('dummy')
+        second = bouwer.util.Cache('dummy')
+
+        first.put('a', 1)
+        first.flush()
+        second.put('b', 2)
+        second.flush()
+        self.assertEqual(second.get('a'), 1)
+
+        first.put('c', 3)
+        first.compact()
+        second.put('d', 4)
+        second.flush()
+
+        cache = bouwer.util.Cache('dummy')
+        self.assertEqual([ cache.get(key) for key in 'abcd' ], [ 1, 2, 3, 4 ])
@@ -0,0 +1,66 @@
+#
+# Copyright (C) 2012 Niek Linnenbank
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import shutil
+import tempfile
+import bouwer.util
+from test import *
+
+class CodeCacheTester(BouwerTester):
+    """ Tests for the :class:`.CodeCache` """
+
+    def setUp(self):
+        """ Runs before each testcase """
+        super(CodeCacheTester, self).setUp()
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        os.chdir(self.tmpdir)
+        bouwer.util.StatCache.Destroy()
+        bouwer.util.CodeCache.Destroy()
+
+    def tearDown(self):
+        """ Runs after each testcase """
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir, True)
+        bouwer.util.StatCache.Destroy()
+        bouwer.util.CodeCache.Destroy()
+
+    def test_compile(self):
+        """ Verify that code is compiled again only if the file changed """
+        open('Bouwfile', 'w').write('x = 1\n')
+        cache = bouwer.util.CodeCache.Instance()
+        cache.cache = bouwer.util.Cache('bytecode')
+
+        globs = {}
+        exec(cache.compile('Bouwfile'), globs)
+        self.assertEqual(globs['x'], 1)
+        self.assertEqual(cache.cache.get(os.path.abspath('Bouwfile'))[0][1], 6)
+
+        # Entries are reused for an unchanged file
+        cache.cache.flush()
+        cache.code = {}
+        cache.cache = bouwer.util.Cache('bytecode')
+        exec(cache.compile('Bouwfile'), globs)
+        self.assertEqual(cache.cache.dirty, set())
+
+        # Changed files are compiled again
+        open('Bouwfile', 'w').write('x = 22\n')
+        bouwer.util.StatCache.Destroy()
+        cache.code = {}
+        exec(cache.compile('Bouwfile'), globs)
+        self.assertEqual(globs['x'], 22)
+        self.assertEqual(cache.cache.dirty, set([ os.path.abspath('Bouwfile') ]))
@@ -0,0 +1,88 @@
+#
+# Copyright (C) 2012 Niek Linnenbank
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import shutil
+import tempfile
+import bouwer.util
+from test import *
+
+class ProjectWalkerTester(BouwerTester):
+    """ Tests for the :class:`.ProjectWalker` """
+
+    def setUp(self):
+        """ Runs before each testcase """
+        super(ProjectWalkerTester, self).setUp()
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        os.chdir(self.tmpdir)
+        self.cache = bouwer.util.Cache('layout')
+
+        for dirname in [ 'sub1/deep', 'sub2/deep' ]:
+            os.makedirs(dirname)
+
+        for filename in [ 'Bouwfile', 'sub1/Bouwfile', 'sub1/deep/Bouwfile',
+                          'sub2/deep/Bouwfile' ]:
+            open(filename, 'w').close()
+
+    def tearDown(self):
+        """ Runs after each testcase """
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir, True)
+        bouwer.util.ProjectWalker.Destroy()
+        bouwer.util.StatCache.Destroy()
+
+    def _walker(self):
+        """ Return a new walker, as used by the next run """
+        bouwer.util.ProjectWalker.Destroy()
+        bouwer.util.StatCache.Destroy()
+        walker = bouwer.util.ProjectWalker.Instance()
+        walker.cache = self.cache
+        return walker
+
+    def _set_mtime(self, dirname, mtime):
+        """ Set the modification time of `dirname` """
+        os.utime(dirname, (mtime, mtime))
+
+    def test_reuse(self):
+        """ Verify listings are reused until the directory changes """
+        mtime = os.stat('sub1').st_mtime
+        self.assertEqual(self._walker().listing('sub1'), ([ 'Bouwfile' ], [ 'deep' ]))
+
+        # The old listing is used while the modification time is the same
+        open('sub1/Bouwconfig', 'w').close()
+        self._set_mtime('sub1', mtime)
+        self.assertEqual(self._walker().listing('sub1'), ([ 'Bouwfile' ], [ 'deep' ]))
+
+    def test_added(self):
+        """ Verify listings are read again after a Bouwfile is added """
+        mtime = os.stat('sub2').st_mtime
+        self.assertNotIn('./sub2/deep/Bouwfile', self._walker().walk('.', 'Bouwfile'))
+
+        open('sub2/Bouwfile', 'w').close()
+        self._set_mtime('sub2', mtime + 10)
+        walker = self._walker()
+        self.assertEqual(walker.listing('sub2'), ([ 'Bouwfile' ], [ 'deep' ]))
+        self.assertIn('./sub2/deep/Bouwfile', walker.walk('.', 'Bouwfile'))
+
+    def test_walk(self):
+        """ Verify only directories below a Bouwfile are searched """
+        walker = self._walker()
+        self.assertEqual(sorted(walker.walk('.', 'Bouwfile')),
+                         [ './Bouwfile', './sub1/Bouwfile', './sub1/deep/Bouwfile' ])
+
+        self.assertIn(os.path.abspath('sub2'), walker.listings)
+        self.assertNotIn(os.path.abspath('sub2/deep'), walker.listings)